@@ -1,12 +1,31 @@
 import numpy
 import svgwrite
-from PIL import Image
 from svgwrite.extensions import Inkscape
 
+from image_cache import cached_image
 
-def open_as_array(fname):
-    i = Image.open(fname).convert('L')
-    return numpy.asarray(i)
+# image rows leveled at a time
+STRIP_ROWS = 256
+
+
+def brightest(img):
+    # the brightest value and the brightest one below it, read a strip at a time
+    strips = [img[start:start + STRIP_ROWS] for start in range(0, img.shape[0], STRIP_ROWS)]
+    top = max(int(numpy.max(strip)) for strip in strips)
+    second = -10000000
+    for strip in strips:
+        below = strip[strip < top]
+        if below.size:
+            second = max(second, int(numpy.max(below)))
+    return top, second
+
+
+def levels(img, top, second):
+    # the brightest pixels are pushed far below zero, the rest scaled to 0-10 against the next brightest
+    img = numpy.where(img == top, -10000000, img)
+    img = img / second
+    img *= 10
+    return numpy.round(img)
 
 
 def cross(x, y, level):
@@ -60,15 +79,12 @@ def cross(x, y, level):
 
 
 def main():
-    img = open_as_array('bobross.png')
-    img = numpy.where(img == numpy.max(img), -10000000, img)
-    img = img / numpy.max(img)
-    img *= 10
-    img = numpy.round(img)
+    # mapped from the image cache and leveled a strip at a time, so the source never has to fit in memory
+    source = cached_image('bobross.png', 'L')
+    top, second = brightest(source)
 
-    (width, height) = img.shape
-    print(img)
-    print(img.shape)
+    (width, height) = source.shape
+    print(source.shape)
 
     drawing = svgwrite.Drawing(filename='cross.svg', size=(width * 7, height * 7))
     inkscape = Inkscape(drawing)
@@ -76,35 +92,37 @@ def main():
     layer = inkscape.layer(label='drawing')
     drawing.add(layer)
 
-    for x in range(width):
-        for y in range(height):
-            cell = img[x, y]
-
-            tmp = cell
-            if cell >= 5:
-                tmp -= 5
-
-            pts = cross(x, y, tmp)
-            for (startpt, endpt) in pts:
-                layer.add(drawing.line(
-                    startpt,
-                    endpt,
-                    stroke=svgwrite.rgb(0, 0, 0, '%'),
-                    stroke_width=1,
-                    stroke_linecap='round',
-                    stroke_opacity=1.0
-                ))
-
-            if 0 <= cell < 5:
-                layer.add(drawing.circle(
-                    center=(7 * x + 3, 7 * y + 3),
-                    r=2.5,
-                    stroke=svgwrite.rgb(0, 0, 0, '%'),
-                    stroke_width=1,
-                    stroke_linecap='round',
-                    stroke_opacity=1.0,
-                    fill='none'
-                ))
+    for start in range(0, width, STRIP_ROWS):
+        img = levels(source[start:start + STRIP_ROWS], top, second)
+        for x in range(start, start + len(img)):
+            for y in range(height):
+                cell = img[x - start, y]
+
+                tmp = cell
+                if cell >= 5:
+                    tmp -= 5
+
+                pts = cross(x, y, tmp)
+                for (startpt, endpt) in pts:
+                    layer.add(drawing.line(
+                        startpt,
+                        endpt,
+                        stroke=svgwrite.rgb(0, 0, 0, '%'),
+                        stroke_width=1,
+                        stroke_linecap='round',
+                        stroke_opacity=1.0
+                    ))
+
+                if 0 <= cell < 5:
+                    layer.add(drawing.circle(
+                        center=(7 * x + 3, 7 * y + 3),
+                        r=2.5,
+                        stroke=svgwrite.rgb(0, 0, 0, '%'),
+                        stroke_width=1,
+                        stroke_linecap='round',
+                        stroke_opacity=1.0,
+                        fill='none'
+                    ))
 
     drawing.save()
 
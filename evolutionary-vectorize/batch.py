@@ -0,0 +1,111 @@
+import argparse
+import json
+import os
+import random
+
+import numpy
+
+import evvec
+from drawing import save_drawing
+from stopwatch import Stopwatch
+
+# IMAGE_EXTENSIONS, find_sources and output_name are kept identical in the evvec and vec batch scripts
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tif', '.tiff')
+
+
+def find_sources(paths):
+    # images named directly, every image in a named directory, and the paths listed in a manifest
+    # (any other file: one path per line, relative to the manifest, # starts a comment)
+    sources = []
+    for path in paths:
+        if os.path.isdir(path):
+            sources.extend(sorted(os.path.join(path, name) for name in os.listdir(path)
+                                  if name.lower().endswith(IMAGE_EXTENSIONS)))
+        elif path.lower().endswith(IMAGE_EXTENSIONS):
+            sources.append(path)
+        else:
+            with open(path) as f:
+                for line in f:
+                    line = line.split('#', 1)[0].strip()
+                    if line:
+                        sources.append(os.path.join(os.path.dirname(path), line))
+    return sources
+
+
+def output_name(source):
+    return os.path.splitext(os.path.basename(source))[0] + '.svg'
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Evolve line drawings of many images at once, every chunk of "
+                                                 "every image sharing one worker pool and palette table")
+    parser.add_argument('targets', nargs='+', help="images, directories of images or manifest files")
+    parser.add_argument('--generations', type=int, default=100)
+    parser.add_argument('--mode', choices=('generational', 'steady', 'islands'), default='generational')
+    parser.add_argument('--out', default='tmp/batch', help="directory for the drawings and summary.json")
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args(argv)
+    args.sources = find_sources(args.targets)
+    if not args.sources:
+        parser.error("no images found in {}".format(' '.join(args.targets)))
+    names = [output_name(source) for source in args.sources]
+    if len(set(names)) != len(names):
+        parser.error("images with the same name would overwrite each other's drawing")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.seed is not None:
+        random.seed(args.seed)
+        evvec.OPERATOR_RNG = numpy.random.default_rng(args.seed)
+    evvec.SOURCE_IMAGES = args.sources
+    os.makedirs(args.out, exist_ok=True)
+    sw = Stopwatch()
+    sw.start()
+    try:
+        # every image's chunks go into one target store, so a single pass of the GA covers all of them
+        targets = evvec.targets()
+        evvec.distance_tables()
+        grids = evvec.chunk_grids()
+        load_seconds = sw.reset()
+
+        pops = [evvec.Population(chunk) for chunk in range(len(targets))]
+        evvec.EVALUATOR.evaluate([unit for pop in pops for unit in pop.pool])
+        evvec.EVALUATOR.reset_stats()
+        if args.mode == 'islands':
+            evaluations = evvec.run_islands(pops, args.generations, None, lambda generation: None)
+        else:
+            run = evvec.run_steady_state if args.mode == 'steady' else evvec.run_generational
+            evaluations = run(pops, args.generations, None, lambda generation: None)
+        evolve_seconds = sw.reset()
+    finally:
+        evvec.THREAD_POOL.shutdown()
+
+    images = []
+    start = 0
+    for source, grid in zip(args.sources, grids):
+        best = [pops[chunk].best() for chunk in range(start, start + len(grid))]
+        start += len(grid)
+        output = os.path.join(args.out, output_name(source))
+        save_drawing(output, (grid.width, grid.height),
+                     [(unit.representation, evvec.chunk_position(unit.chunk)) for unit in best])
+        images.append({'source': source, 'output': output, 'chunks': len(grid),
+                       'mean_best_fitness': float(numpy.mean([unit.fitness for unit in best]))})
+    write_seconds = sw.reset()
+
+    total = load_seconds + evolve_seconds + write_seconds
+    summary = {'generations': args.generations, 'mode': args.mode, 'images': images, 'evaluations': evaluations,
+               'load_seconds': load_seconds, 'evolve_seconds': evolve_seconds, 'write_seconds': write_seconds,
+               'total_seconds': total, 'seconds_per_image': total / len(images)}
+    with open(os.path.join(args.out, 'summary.json'), 'w') as f:
+        json.dump(summary, f, indent=2)
+    for image in images:
+        print("{source}: {chunks} chunks, mean best {mean_best_fitness:.1f} -> {output}".format(**image))
+    print("{} images in {:.2f}s ({:.2f}s per image): load {:.2f}s, evolve {:.2f}s, write {:.2f}s".format(
+        len(images), total, total / len(images), load_seconds, evolve_seconds, write_seconds))
+    print(evvec.rate_report(evaluations, evolve_seconds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+import json
+import os
+from collections import namedtuple
+
+import numpy
+
+from genome import GENE_DTYPE
+
+CHECKPOINT_VERSION = 1
+
+SavedUnit = namedtuple('SavedUnit', 'genome fitness')
+
+
+class Checkpoint:
+    # Everything needed to continue a run: the pool of every chunk as genome rows and fitness, each
+    # chunk's generation and scale, and a JSON-able `state` (RNG state, scheduler) for the rest. Saved as
+    # one compressed .npz, written to a temporary file and moved into place so a crash never leaves a
+    # half-written checkpoint behind.
+
+    def __init__(self, pools, generations, scales, state):
+        # pools: per chunk, a list of units with .genome and .fitness; a loaded checkpoint holds SavedUnits
+        self.pools = pools
+        self.generations = generations
+        self.scales = scales
+        self.state = state
+
+    def save(self, path):
+        units = [unit for pool in self.pools for unit in pool]
+        genomes = [numpy.asarray(unit.genome, dtype=GENE_DTYPE) for unit in units]
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            numpy.savez_compressed(
+                f,
+                genes=numpy.concatenate(genomes) if genomes else numpy.zeros(0, dtype=GENE_DTYPE),
+                gene_counts=numpy.array([len(genome) for genome in genomes], dtype=numpy.int32),
+                fitness=numpy.array([unit.fitness for unit in units], dtype=numpy.float64),
+                pool_sizes=numpy.array([len(pool) for pool in self.pools], dtype=numpy.int32),
+                generations=numpy.array(self.generations, dtype=numpy.int32),
+                scales=numpy.array(self.scales, dtype=numpy.int32),
+                state=numpy.frombuffer(json.dumps(dict(self.state, version=CHECKPOINT_VERSION)).encode(),
+                                       dtype=numpy.uint8))
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def load(path):
+        with numpy.load(path, allow_pickle=False) as data:
+            state = json.loads(data['state'].tobytes().decode())
+            if state.get('version') != CHECKPOINT_VERSION:
+                raise ValueError("{} is a version {} checkpoint, expected {}".format(path, state.get('version'),
+                                                                                   CHECKPOINT_VERSION))
+            genomes = numpy.split(data['genes'], numpy.cumsum(data['gene_counts'])[:-1])
+            units = [SavedUnit(genome, fitness) for genome, fitness in zip(genomes, data['fitness'].tolist())]
+            bounds = numpy.cumsum(data['pool_sizes']).tolist()
+            pools = [units[start:end] for start, end in zip([0] + bounds[:-1], bounds)]
+            return Checkpoint(pools, data['generations'].tolist(), data['scales'].tolist(), state)
@@ -1,19 +1,18 @@
-from math import ceil
+import sys
 
+import numpy
 from PIL import Image
 
+from chunking import ChunkGrid
+
 CHUNK_X = 25
 CHUNK_Y = CHUNK_X
 
 if __name__ == '__main__':
-    img = Image.open('bobross.png').convert('RGB')
-    width = 550
-    height = 425
-    xs = ceil(width / CHUNK_X)
-    ys = ceil(height / CHUNK_Y)
+    # Exports the chunks evvec works on as PNGs; evvec itself chunks the source image in memory
+    source = sys.argv[1] if len(sys.argv) > 1 else 'bobross.png'
+    chunk_size = int(sys.argv[2]) if len(sys.argv) > 2 else CHUNK_X
+    grid = ChunkGrid(numpy.asarray(Image.open(source).convert('RGB')), chunk_size)
 
-    ctr = 0
-    for i in range(xs):
-        for j in range(ys):
-            c = img.crop((i * CHUNK_X, j * CHUNK_Y, i * CHUNK_X + CHUNK_X, j * CHUNK_Y + CHUNK_Y)).save('bobross-{}.png'.format(ctr))
-            ctr += 1
+    for ctr in range(len(grid)):
+        Image.fromarray(numpy.ascontiguousarray(grid.tile(ctr))).save('bobross-{}.png'.format(ctr))
@@ -0,0 +1,68 @@
+import tempfile
+from math import ceil
+
+import numpy
+from PIL import Image
+from numpy.lib.stride_tricks import as_strided
+
+
+class ChunkGrid:
+    # Splits an (height, width, channels) image into chunk_size squares without copying. Chunks are
+    # numbered column by column like chunk_img.py always did, so chunk n sits at grid column
+    # n // rows and grid row n % rows. Images that are not a multiple of chunk_size are padded with
+    # black, the same as cropping past the edge with PIL. A memory-mapped image is padded into a temporary
+    # file, so a grid over an image larger than memory only ever pages in the chunks being read.
+
+    def __init__(self, image, chunk_size):
+        self.chunk_size = chunk_size
+        self.height, self.width = image.shape[:2]
+        self.columns = int(ceil(self.width / chunk_size))
+        self.rows = int(ceil(self.height / chunk_size))
+
+        padded_shape = (self.rows * chunk_size, self.columns * chunk_size) + image.shape[2:]
+        if padded_shape != image.shape:
+            if isinstance(image, numpy.memmap):
+                padded = numpy.memmap(tempfile.TemporaryFile(), dtype=image.dtype, mode='w+', shape=padded_shape)
+                for top in range(0, self.height, chunk_size):
+                    padded[top:top + chunk_size, :self.width] = image[top:top + chunk_size]
+            else:
+                padded = numpy.zeros(padded_shape, dtype=image.dtype)
+                padded[:self.height, :self.width] = image
+            image = padded
+        self.image = image
+
+        row_stride, col_stride = image.strides[:2]
+        # [column, row, x, y, channel]: chunks are indexed by (x, y) like allele coordinates
+        self.chunks = as_strided(image, shape=(self.columns, self.rows, chunk_size, chunk_size) + image.shape[2:],
+                                 strides=(chunk_size * col_stride, chunk_size * row_stride,
+                                          col_stride, row_stride) + image.strides[2:],
+                                 writeable=False)
+
+    def __len__(self):
+        return self.columns * self.rows
+
+    def __getitem__(self, chunk):
+        # (x, y) indexed view of one chunk
+        return self.chunks[chunk // self.rows, chunk % self.rows]
+
+    def tile(self, chunk):
+        # the same chunk in image orientation, (y, x) indexed
+        return numpy.swapaxes(self[chunk], 0, 1)
+
+    def position(self, chunk):
+        return (chunk // self.rows) * self.chunk_size, (chunk % self.rows) * self.chunk_size
+
+    def stack(self, start=0, stop=None):
+        # contiguous (chunks, x, y, channels) copy of chunks start to stop, every chunk by default
+        stop = len(self) if stop is None else min(stop, len(self))
+        return numpy.stack([self[chunk] for chunk in range(start, stop)])
+
+    def blocks(self, size):
+        # the stack in copies of at most `size` chunks
+        for start in range(0, len(self), size):
+            yield self.stack(start, start + size)
+
+
+def downsample_chunks(chunks, size):
+    # (chunks, x, y, channels) stack with every chunk box-filtered down to size x size
+    return numpy.stack([numpy.asarray(Image.fromarray(chunk).resize((size, size), Image.BOX)) for chunk in chunks])
@@ -0,0 +1,120 @@
+import sys
+from functools import lru_cache
+
+import numpy
+
+# sRGB (D65) -> XYZ, same constants colormath uses for sRGBColor
+RGB_TO_XYZ = numpy.array((
+    (0.412424, 0.357579, 0.180464),
+    (0.212656, 0.715158, 0.0721856),
+    (0.0193324, 0.119193, 0.950444)))
+D65_WHITE = numpy.array((0.95047, 1.00000, 1.08883))
+CIE_E = 216.0 / 24389.0
+
+
+def srgb_to_lab(rgb):
+    # (..., 3) array of 0-255 sRGB values -> (..., 3) float64 Lab, like convert_color(sRGBColor, LabColor)
+    rgb = numpy.asarray(rgb, dtype=numpy.float64) / 255.0
+    linear = numpy.where(rgb <= 0.04045, rgb / 12.92, numpy.power((rgb + 0.055) / 1.055, 2.4))
+    xyz = numpy.maximum(linear.dot(RGB_TO_XYZ.T), 0.0) / D65_WHITE
+    f = numpy.where(xyz > CIE_E, numpy.cbrt(xyz), 7.787 * xyz + 16.0 / 116.0)
+    lab = numpy.empty(f.shape)
+    lab[..., 0] = 116.0 * f[..., 1] - 16.0
+    lab[..., 1] = 500.0 * (f[..., 0] - f[..., 1])
+    lab[..., 2] = 200.0 * (f[..., 1] - f[..., 2])
+    return lab
+
+
+def delta_e_cie2000(lab1, lab2):
+    # Element-wise CIEDE2000 with broadcasting, following colormath's formulation step by step
+    L1, a1, b1 = lab1[..., 0], lab1[..., 1], lab1[..., 2]
+    L2, a2, b2 = lab2[..., 0], lab2[..., 1], lab2[..., 2]
+
+    avg_Lp = (L1 + L2) / 2.0
+    C1 = numpy.sqrt(a1 ** 2 + b1 ** 2)
+    C2 = numpy.sqrt(a2 ** 2 + b2 ** 2)
+    avg_C = (C1 + C2) / 2.0
+    G = 0.5 * (1 - numpy.sqrt(avg_C ** 7.0 / (avg_C ** 7.0 + 25.0 ** 7.0)))
+
+    a1p = (1.0 + G) * a1
+    a2p = (1.0 + G) * a2
+    C1p = numpy.sqrt(a1p ** 2 + b1 ** 2)
+    C2p = numpy.sqrt(a2p ** 2 + b2 ** 2)
+    avg_Cp = (C1p + C2p) / 2.0
+
+    h1p = numpy.degrees(numpy.arctan2(b1, a1p))
+    h1p = h1p + (h1p < 0) * 360
+    h2p = numpy.degrees(numpy.arctan2(b2, a2p))
+    h2p = h2p + (h2p < 0) * 360
+
+    avg_Hp = ((numpy.fabs(h1p - h2p) > 180) * 360 + h1p + h2p) / 2.0
+    T = 1 - 0.17 * numpy.cos(numpy.radians(avg_Hp - 30)) + \
+        0.24 * numpy.cos(numpy.radians(2 * avg_Hp)) + \
+        0.32 * numpy.cos(numpy.radians(3 * avg_Hp + 6)) - \
+        0.2 * numpy.cos(numpy.radians(4 * avg_Hp - 63))
+
+    diff_hp = h2p - h1p
+    delta_hp = diff_hp + (numpy.fabs(diff_hp) > 180) * 360 - (h2p > h1p) * 720
+
+    delta_Lp = L2 - L1
+    delta_Cp = C2p - C1p
+    delta_Hp = 2 * numpy.sqrt(C2p * C1p) * numpy.sin(numpy.radians(delta_hp) / 2.0)
+
+    S_L = 1 + (0.015 * (avg_Lp - 50) ** 2) / numpy.sqrt(20 + (avg_Lp - 50) ** 2.0)
+    S_C = 1 + 0.045 * avg_Cp
+    S_H = 1 + 0.015 * avg_Cp * T
+
+    delta_ro = 30 * numpy.exp(-(((avg_Hp - 275) / 25) ** 2.0))
+    R_C = numpy.sqrt(avg_Cp ** 7.0 / (avg_Cp ** 7.0 + 25.0 ** 7.0))
+    R_T = -2 * R_C * numpy.sin(2 * numpy.radians(delta_ro))
+
+    return numpy.sqrt(
+        (delta_Lp / S_L) ** 2 +
+        (delta_Cp / S_C) ** 2 +
+        (delta_Hp / S_H) ** 2 +
+        R_T * (delta_Cp / S_C) * (delta_Hp / S_H))
+
+
+@lru_cache(maxsize=None)
+def _palette_lab(palette):
+    lab = srgb_to_lab(numpy.array(palette))
+    lab.setflags(write=False)
+    return lab
+
+
+def palette_lab(palette):
+    return _palette_lab(tuple(tuple(int(v) for v in color) for color in palette))
+
+
+def distance_matrix(rgb, palette):
+    # (N, 3) sRGB pixels -> (N, len(palette)) CIEDE2000 distances
+    lab = srgb_to_lab(numpy.asarray(rgb).reshape(-1, 3))
+    return delta_e_cie2000(lab[:, None, :], palette_lab(palette)[None, :, :])
+
+
+def parity_check(samples=2000, seed=0):
+    from colormath.color_conversions import convert_color
+    from colormath.color_diff import delta_e_cie2000 as colormath_delta_e
+    from colormath.color_objects import sRGBColor, LabColor
+
+    rng = numpy.random.RandomState(seed)
+    rgb = rng.randint(0, 256, size=(samples, 3))
+    ref = rng.randint(0, 256, size=(samples, 3))
+    # make sure the extremes and greys (zero chroma) are covered
+    rgb[:4] = ((0, 0, 0), (255, 255, 255), (128, 128, 128), (255, 0, 0))
+
+    def to_lab(c):
+        return convert_color(sRGBColor(c[0], c[1], c[2], True), LabColor)
+
+    expected_lab = numpy.array([to_lab(c).get_value_tuple() for c in rgb])
+    expected_de = numpy.array([colormath_delta_e(to_lab(c1), to_lab(c2)) for c1, c2 in zip(rgb, ref)])
+
+    lab_error = numpy.max(numpy.abs(srgb_to_lab(rgb) - expected_lab))
+    de_error = numpy.max(numpy.abs(delta_e_cie2000(srgb_to_lab(rgb), srgb_to_lab(ref)) - expected_de))
+    return lab_error, de_error
+
+
+if __name__ == "__main__":
+    lab_err, de_err = parity_check()
+    print("max |Lab - colormath| = {}, max |dE2000 - colormath| = {}".format(lab_err, de_err))
+    sys.exit(0 if lab_err < 1e-9 and de_err < 1e-9 else 1)
@@ -0,0 +1,30 @@
+import svgwrite
+from svgwrite.extensions import Inkscape
+
+
+def add_to_drawing(drawing, inkscape, layers, representation, offset=(0, 0)):
+    ox, oy = offset
+    color_counter = 0
+    for color in representation.keys():
+        if color not in layers:
+            layers[color] = inkscape.layer("{}".format(color_counter))
+            color_counter += 1
+            drawing.add(layers[color])
+        svg_color = svgwrite.rgb(color[0], color[1], color[2])
+        for allele in representation[color]:
+            layer = layers[color]
+            start_pt = allele.start[0] + ox, allele.start[1] + oy
+            end_pt = allele.end[0] + ox, allele.end[1] + oy
+            layer.add(drawing.line(start_pt, end_pt, stroke_width=1, stroke=svg_color))
+    return drawing
+
+
+def save_drawing(filename, size, placed):
+    # placed: (representation, offset) pairs, drawn into one color layer per color
+    # validation costs more than building the drawing; the elements come from known-good code
+    drawing = svgwrite.Drawing(size=size, filename=filename, debug=False)
+    inkscape = Inkscape(drawing)
+    layers = {}
+    for representation, offset in placed:
+        add_to_drawing(drawing, inkscape, layers, representation, offset=offset)
+    drawing.save(pretty=True, indent=2)
@@ -0,0 +1,231 @@
+import math
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+BATCHES_PER_WORKER = 4
+MIN_BATCH_SIZE = 8
+FITNESS_CACHE_SIZE = 256
+
+
+def evaluate_batch(jobs):
+    # Runs in a worker: score a list of (fn, args) jobs and report how long the worker was busy
+    start = time.perf_counter()
+    scores = [fn(*args) for fn, args in jobs]
+    return scores, time.perf_counter() - start
+
+
+class InlineExecutor:
+    # Runs each submitted call right away in this process, for an evaluator that lives inside a worker
+
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+
+class UnitFuture:
+    # The future of a single-unit batch from BatchEvaluator.start(): result() is the unit's score, and
+    # the worker's busy time is counted once, when it is first read
+
+    def __init__(self, future, evaluator, key):
+        self.future = future
+        self.evaluator = evaluator
+        self.key = key
+        self.score = None
+
+    def result(self):
+        if self.score is None:
+            scores, busy = self.future.result()
+            self.score = scores[0]
+            self.evaluator.busy += busy
+            if self.key is not None:
+                self.evaluator.cache.put(self.key[0], self.key[1], self.score)
+        return self.score
+
+
+class FitnessCache:
+    # Per-chunk LRU of fitness by genome key, at most `size` entries per chunk
+
+    def __init__(self, size=FITNESS_CACHE_SIZE):
+        self.size = size
+        self.chunks = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, chunk, key):
+        entries = self.chunks.get(chunk)
+        if entries is not None and key in entries:
+            entries.move_to_end(key)
+            self.hits += 1
+            return entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, chunk, key, fitness):
+        entries = self.chunks.setdefault(chunk, OrderedDict())
+        entries[key] = fitness
+        entries.move_to_end(key)
+        if len(entries) > self.size:
+            entries.popitem(last=False)
+
+    def __len__(self):
+        return sum(len(entries) for entries in self.chunks.values())
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def report(self):
+        return "fitness cache {} hits / {} misses ({:.0%}), {} entries".format(self.hits, self.misses,
+                                                                              self.hit_rate, len(self))
+
+
+class BatchEvaluator:
+    # Collects unevaluated units and scores them in sized batches on a worker pool, instead of one
+    # future per unit. Units provide fitness_job() -> (fn, args), an evaluated flag, set_fitness() and
+    # cache_key(); units whose genome was already scored for their chunk are filled from the cache.
+    # evaluate() blocks until every unit is scored; submit()/complete() let callers overlap batches.
+    # start() is the unbatched path, one future per unit, still counted and cached like the others.
+
+    def __init__(self, pool, workers, batches_per_worker=BATCHES_PER_WORKER, min_batch_size=MIN_BATCH_SIZE,
+                 cache=None):
+        self.pool = pool
+        self.cache = cache
+        self.workers = workers
+        self.batches_per_worker = batches_per_worker
+        self.min_batch_size = min_batch_size
+        self.submitted = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.units = 0
+        self.local = 0
+        self.batches = 0
+        self.busy = 0.0
+        self.wall = 0.0
+
+    def batch_size(self, count):
+        return max(self.min_batch_size, int(math.ceil(count / (self.workers * self.batches_per_worker))))
+
+    def lookup(self, unit):
+        # cached fitness of an equivalent genome, or None
+        if self.cache is None:
+            return None
+        return self.cache.get(unit.chunk, unit.cache_key())
+
+    def remember(self, unit, fitness):
+        if self.cache is not None:
+            self.cache.put(unit.chunk, unit.cache_key(), fitness)
+
+    def _claim(self, units):
+        # units that need a submission, as (unit, cache key) pairs; cached ones are filled in place
+        pending = []
+        # with a cache, equivalent genomes in one call share a single submission
+        waiting = {}
+        seen = set()
+        for unit in units:
+            if unit.evaluated or id(unit) in seen:
+                continue
+            seen.add(id(unit))
+            if self.cache is None:
+                pending.append((unit, None))
+                continue
+            key = (unit.chunk, unit.cache_key())
+            if key in waiting:
+                self.cache.hits += 1
+                waiting[key].append(unit)
+                continue
+            fitness = self.cache.get(*key)
+            if fitness is not None:
+                unit.set_fitness(fitness)
+                continue
+            waiting[key] = []
+            pending.append((unit, key))
+        return pending, waiting
+
+    def _apply(self, batch, waiting, future):
+        scores, busy = future.result()
+        for (unit, key), score in zip(batch, scores):
+            unit.set_fitness(score)
+            if key is not None:
+                self.cache.put(key[0], key[1], score)
+                for duplicate in waiting[key]:
+                    duplicate.set_fitness(score)
+        self.busy += busy
+        self.units += len(batch)
+        self.batches += 1
+
+    def evaluate(self, units):
+        pending, waiting = self._claim(units)
+        if not pending:
+            return
+
+        start = time.perf_counter()
+        size = self.batch_size(len(pending))
+        batches = [pending[i:i + size] for i in range(0, len(pending), size)]
+        futures = [self.pool.submit(evaluate_batch, [unit.fitness_job() for unit, _ in batch]) for batch in batches]
+        for batch, future in zip(batches, futures):
+            self._apply(batch, waiting, future)
+        self.wall += time.perf_counter() - start
+
+    def submit(self, units):
+        # Starts scoring `units` as a single batch without waiting for it. Returns a future, or None when
+        # every unit was already scored; pass the future to complete() once it is done.
+        pending, waiting = self._claim(units)
+        if not pending:
+            return None
+        future = self.pool.submit(evaluate_batch, [unit.fitness_job() for unit, _ in pending])
+        self.submitted[future] = (pending, waiting)
+        return future
+
+    def complete(self, future):
+        pending, waiting = self.submitted.pop(future)
+        self._apply(pending, waiting, future)
+
+    def start(self, unit):
+        # Starts scoring one unit on its own without waiting for it, as the unbatched path always did.
+        # Returns its future; only the busy time of futures that were read is counted, and the wall
+        # time is not measured, so the report leaves out utilization.
+        key = None
+        if self.cache is not None:
+            key = (unit.chunk, unit.cache_key())
+            fitness = self.cache.get(*key)
+            if fitness is not None:
+                future = Future()
+                future.set_result(fitness)
+                return future
+        self.units += 1
+        self.batches += 1
+        return UnitFuture(self.pool.submit(evaluate_batch, [unit.fitness_job()]), self, key)
+
+    def record_wall(self, seconds):
+        # time spent waiting on submit()ted batches, for utilization
+        self.wall += seconds
+
+    def record_local(self, count=1):
+        # units scored in the main process without a submission
+        self.local += count
+
+    @property
+    def evaluations(self):
+        return self.units + self.local
+
+    @property
+    def mean_batch_size(self):
+        return self.units / self.batches if self.batches else 0.0
+
+    @property
+    def utilization(self):
+        return self.busy / (self.wall * self.workers) if self.wall else 0.0
+
+    def report(self):
+        report = "Evaluated {} units in {} batches ({:.1f} per batch), ".format(self.units, self.batches,
+                                                                              self.mean_batch_size)
+        if self.wall:
+            report += "worker utilization {:.0%}, ".format(self.utilization)
+        report += "{} scored locally".format(self.local)
+        if self.cache is not None:
+            report += ", " + self.cache.report()
+        return report
@@ -1,7 +1,10 @@
+import argparse
 import datetime
 import heapq
 import random
 import os
+import queue
+import time
 import uuid
 from concurrent.futures.process import ProcessPoolExecutor
 from concurrent.futures.thread import ThreadPoolExecutor
@@ -10,17 +13,60 @@ from io import BytesIO
 import cairosvg
 import numpy
 import svgwrite
-from PIL import Image
 from colormath.color_conversions import convert_color
 from colormath.color_diff import delta_e_cie2000
+from checkpoint import Checkpoint
+from chunking import ChunkGrid, downsample_chunks
 from colormath.color_objects import sRGBColor, LabColor
+from drawing import add_to_drawing, save_drawing
+from evaluation import BatchEvaluator, FitnessCache, InlineExecutor
+from fitness import apply_delta, fitness_state, palette_distances, rasterize, rasterize_genome, score_strokes, \
+    surrogate_scores
+from genome import genome_diff, genome_key, genome_to_representation, mutate_genome, pack_genome, random_genome, \
+    recombine_genomes, representation_to_genome, scale_genome, unpack_genome
+from image_cache import cached_image
+from operators import crossover_genomes, mutate_genomes, tournament_winners
+from palette_lut import PaletteLUT, palette_key
+from raster import segment_pts
+from runlog import RunLog
+from scheduler import ChunkScheduler
+from snapshots import SnapshotWriter
+from surrogate import SURROGATE_AUDIT_RATE, SurrogateScreen
 from stopwatch import Stopwatch
+from targets import TargetStore, load_or_publish, sources_key
 from svgwrite.extensions import Inkscape
 
-THREAD_POOL = ProcessPoolExecutor(max_workers=4)
-
-PAPER_WIDTH = 25
-PAPER_HEIGHT = 25
+WORKERS = 4
+THREAD_POOL = ProcessPoolExecutor(max_workers=WORKERS)
+# score new units in bulk through EVALUATOR instead of submitting one future per unit
+BATCH_EVALUATION = True
+# per-chunk LRU of scores by canonical genome hash, so duplicate candidates are never resubmitted
+FITNESS_CACHE = FitnessCache(size=256)
+EVALUATOR = BatchEvaluator(THREAD_POOL, WORKERS, cache=FITNESS_CACHE)
+# score array-genome children from their parent's cached coverage when they differ from it by at most
+# DELTA_MAX_FRACTION of their strokes. A delta is several times cheaper than a full score, but it runs
+# where the child is bred, so with a worker pool it only pays off once the workers are the bottleneck.
+INCREMENTAL_FITNESS = False
+DELTA_MAX_FRACTION = 0.5
+# when set (by --surrogate-keep), a SurrogateScreen that drops the offspring least likely to survive
+# before they are scored exactly
+SURROGATE = None
+# smallest submission in steady-state mode, in units
+STEADY_BATCH_UNITS = 256
+# island mode: chunk groups per worker, and generations between migrations
+ISLANDS_PER_WORKER = 2
+MIGRATE_EVERY = 5
+# breed array genomes with the batched NumPy operators of operators.py, every chunk of a generation in one
+# pass, drawing from OPERATOR_RNG (seeded by --seed, saved in checkpoints)
+BATCHED_OPERATORS = True
+OPERATOR_RNG = numpy.random.default_rng()
+
+SOURCE_IMAGE = 'bobross.png'
+# every image evolved by this process, their chunks numbered one image after another; batch.py sets several
+SOURCE_IMAGES = [SOURCE_IMAGE]
+CHUNK_SIZE = 25
+PAPER_WIDTH = CHUNK_SIZE
+PAPER_HEIGHT = CHUNK_SIZE
 VECTOR_MANHATTAN_MAX = 5
 
 COLORS = [
@@ -48,15 +94,79 @@ COLORS = [
     (90, 114, 143),
 ]
 
+PALETTE_INDEX = {color: i for i, color in enumerate(COLORS)}
+
 MAX_INITIAL_GENES = 1
 
+# 'array' stores units as compact structured arrays, 'dict' as the original color -> [Allele] object graph
+GENOME = 'array'
+
+# 'numpy' scores whole units with array operations, 'colormath' is the original per-pixel scorer
+FITNESS_ENGINE = 'numpy'
+# None scores against the stored Lab targets directly, which matches colormath and takes about a second
+# for every chunk. A table (bits per channel, see PaletteLUT) stores float32 distances, so it drifts from
+# colormath by up to about 1e-4, and the 8-bit one takes minutes to build the first time.
+PALETTE_LUT_BITS = None
+
+
+# chunks converted to targets at a time, which bounds the memory publishing the targets takes
+TARGET_BLOCK_CHUNKS = 256
+# set by the first process to load the targets, so workers started later map the same files
+TARGET_STORE_ENV = 'EVVEC_TARGET_STORE'
+_GRIDS = None
+_TARGETS = {}
+
+
+def chunk_grids():
+    global _GRIDS
+    if _GRIDS is None:
+        # mapped from the image cache, so sources larger than memory are read a chunk row at a time
+        _GRIDS = [ChunkGrid(cached_image(source), CHUNK_SIZE) for source in SOURCE_IMAGES]
+    return _GRIDS
+
+
+def chunk_grid():
+    # the grid of the first, usually the only, source image
+    return chunk_grids()[0]
+
+
+def chunk_source(chunk):
+    # (index in SOURCE_IMAGES, chunk number within that image) of a chunk of the targets
+    for index, grid in enumerate(chunk_grids()):
+        if chunk < len(grid):
+            return index, chunk
+        chunk -= len(grid)
+    raise IndexError("chunk out of range")
+
+
+def targets(resolution=CHUNK_SIZE):
+    # chunk targets, box-filtered down to resolution x resolution for the coarse levels
+    if resolution not in _TARGETS:
+        env = TARGET_STORE_ENV if resolution == CHUNK_SIZE else '{}_{}'.format(TARGET_STORE_ENV, resolution)
+        base = os.environ.get(env)
+        if base and TargetStore.exists(base):
+            _TARGETS[resolution] = TargetStore(base)
+        elif resolution == CHUNK_SIZE:
+            _TARGETS[resolution] = load_or_publish(sources_key(SOURCE_IMAGES, CHUNK_SIZE),
+                                                   lambda: (block for grid in chunk_grids()
+                                                            for block in grid.blocks(TARGET_BLOCK_CHUNKS)),
+                                                   sum(len(grid) for grid in chunk_grids()))
+        else:
+            _TARGETS[resolution] = load_or_publish(sources_key(SOURCE_IMAGES, CHUNK_SIZE, resolution),
+                                                   lambda: downsampled_blocks(targets().rgb, resolution),
+                                                   len(targets()))
+        os.environ[env] = _TARGETS[resolution].base
+    return _TARGETS[resolution]
+
 
-def open_as_array(fname):
-    i = Image.open(fname).convert('RGB')
-    return numpy.asarray(i)
+def downsampled_blocks(rgb, resolution):
+    for start in range(0, len(rgb), TARGET_BLOCK_CHUNKS):
+        yield downsample_chunks(rgb[start:start + TARGET_BLOCK_CHUNKS], resolution)
 
 
-TARGET_ARRAY = [open_as_array('chunks/bobross-{}.png'.format(i)) for i in range(374)]
+def stroke_reach(resolution):
+    # VECTOR_MANHATTAN_MAX at full resolution, scaled down with the level
+    return max(1, int(round(VECTOR_MANHATTAN_MAX * resolution / CHUNK_SIZE)))
 
 
 def population_size(gen):
@@ -116,19 +226,6 @@ def top_k_selection(candidates, k):
     return heapq.nlargest(k, candidates, key=lambda x: x.fitness)
 
 
-def pts_recursive(pt1, pt2):
-    mx = round((pt1[0] + pt2[0]) / 2)
-    my = round((pt1[1] + pt2[1]) / 2)
-    mp = (mx, my)
-
-    if mp == pt1:
-        return [pt1]
-    if mp == pt2:
-        return [pt2]
-
-    return pts_recursive(pt1, mp) + [mp] + pts_recursive(mp, pt2)
-
-
 class Allele:
     start = None
     end = None
@@ -140,7 +237,7 @@ class Allele:
         self.end = (ex, ey)
 
     def allele_pts(self):
-        return set(pts_recursive(self.start, self.end))
+        return set(map(tuple, segment_pts(self.start, self.end).tolist()))
 
 
 def to_lab_color(c1):
@@ -153,7 +250,64 @@ def color_distance(c1, c2):
     return delta_e_cie2000(c1, c2)
 
 
+_PALETTE_LUT = None
+_CHUNK_DISTANCES = {}
+
+
+def palette_lut():
+    global _PALETTE_LUT
+    if _PALETTE_LUT is None and PALETTE_LUT_BITS is not None:
+        _PALETTE_LUT = PaletteLUT(COLORS, bits=PALETTE_LUT_BITS)
+    return _PALETTE_LUT
+
+
+def distance_tables(resolution=CHUNK_SIZE):
+    # (chunks, colors, rows, cols) palette distances of every target, published in the target store so
+    # the workers map one shared copy instead of each building its own
+    store = targets(resolution)
+    return store.table('distances-' + palette_key(COLORS, PALETTE_LUT_BITS),
+                       lambda chunk: palette_distances(store[chunk], COLORS, lut=palette_lut(),
+                                                       target_lab=store.lab[chunk]))
+
+
+def chunk_distances(chunk, resolution=CHUNK_SIZE):
+    key = chunk, resolution
+    if key not in _CHUNK_DISTANCES:
+        # a plain ndarray view of the mapped table, which slices faster than the memmap subclass
+        _CHUNK_DISTANCES[key] = numpy.asarray(distance_tables(resolution)[chunk])
+    return _CHUNK_DISTANCES[key]
+
+
 def compute_fitness(representation, chunk):
+    if FITNESS_ENGINE == 'colormath':
+        return compute_fitness_colormath(representation, chunk)
+    return compute_fitness_numpy(representation, chunk)
+
+
+def compute_fitness_numpy(representation, chunk):
+    distances = chunk_distances(chunk)
+    stroke_colors, stroke_lengths, pixels = rasterize(representation, PALETTE_INDEX, distances.shape[2])
+    return score_strokes(stroke_colors, stroke_lengths, pixels, distances)
+
+
+def compute_genome_fitness(genome, chunk, resolution=CHUNK_SIZE):
+    if FITNESS_ENGINE == 'colormath':
+        return compute_fitness_colormath(genome_to_representation(genome, COLORS), chunk)
+    distances = chunk_distances(chunk, resolution)
+    stroke_colors, stroke_lengths, pixels = rasterize_genome(genome, distances.shape[2])
+    return score_strokes(stroke_colors, stroke_lengths, pixels, distances)
+
+
+def compute_packed_fitness(genome_bytes, chunk, resolution=CHUNK_SIZE):
+    return compute_genome_fitness(unpack_genome(genome_bytes), chunk, resolution)
+
+
+def surrogate_fitness(units):
+    # surrogate scores of offspring that all belong to one chunk and resolution
+    return surrogate_scores([unit.genome for unit in units], chunk_distances(units[0].chunk, units[0].resolution))
+
+
+def compute_fitness_colormath(representation, chunk):
     sw = Stopwatch()
     sw.start()
     score = 0
@@ -168,7 +322,7 @@ def compute_fitness(representation, chunk):
             gene_ct += 1
             pts = allele.allele_pts()
             for pt in pts:
-                pt_color = to_lab_color(TARGET_ARRAY[chunk][pt[0], pt[1]])
+                pt_color = to_lab_color(targets()[chunk][pt[0], pt[1]])
                 dist = color_distance(lab_c1, pt_color)
                 # print("pt {} draw {} dist {}".format(color, pt_color, dist))
                 score += 50 - dist
@@ -191,25 +345,10 @@ def unit_to_svg(representation):
     return add_to_drawing(drawing, inkscape, layers, representation)
 
 
-def add_to_drawing(drawing, inkscape, layers, representation, offset=(0, 0)):
-    ox, oy = offset
-    color_counter = 0
-    for color in representation.keys():
-        if color not in layers:
-            layers[color] = inkscape.layer("{}".format(color_counter))
-            color_counter += 1
-            drawing.add(layers[color])
-        svg_color = svgwrite.rgb(color[0], color[1], color[2])
-        for allele in representation[color]:
-            layer = layers[color]
-            start_pt = allele.start[0] + ox, allele.start[1] + oy
-            end_pt = allele.end[0] + ox, allele.end[1] + oy
-            layer.add(drawing.line(start_pt, end_pt, stroke_width=1, stroke=svg_color))
-    return drawing
-
-
 def chunk_position(chunk_num):
-    return (chunk_num // 22) * 25, (chunk_num % 22) * 25
+    # position within the chunk's own source image
+    index, chunk = chunk_source(chunk_num)
+    return chunk_grids()[index].position(chunk)
 
 
 class MockFuture:
@@ -220,10 +359,50 @@ class MockFuture:
         return self.res
 
 
-class Unit:
-    representation = {}
+class BaseUnit:
     _fitness = None
     chunk = None
+    # side of the square the endpoints live in; below CHUNK_SIZE in the coarse levels
+    resolution = CHUNK_SIZE
+
+    def _start_fitness(self):
+        if not BATCH_EVALUATION:
+            self._fitness = EVALUATOR.start(self)
+
+    def fitness_job(self):
+        # abstract: (fn, args) that score this unit in a worker
+        raise NotImplementedError
+
+    def cache_key(self):
+        # abstract: hashable identity of the genome, equal for units that must score the same
+        raise NotImplementedError
+
+    @property
+    def evaluated(self):
+        return self._fitness is not None
+
+    def set_fitness(self, value):
+        self._fitness = MockFuture(value)
+
+    @property
+    def fitness(self):
+        if self._fitness is None:
+            EVALUATOR.evaluate([self])
+        return self._fitness.result()
+
+    def __repr__(self):
+        return self.__str__()
+
+    def to_svg(self):
+        return unit_to_svg(self.representation)
+
+    def add_to_drawing(self, drawing, inkscape, layers):
+        chunk_pos = chunk_position(self.chunk)
+        return add_to_drawing(drawing, inkscape, layers, self.representation, offset=chunk_pos)
+
+
+class Unit(BaseUnit):
+    representation = {}
 
     def __init__(self, chunk, representation=None):
         self.chunk = chunk
@@ -232,8 +411,17 @@ class Unit:
                                    COLORS}
         else:
             self.representation = representation
-        # self._fitness = MockFuture(compute_fitness(self.representation, self.chunk))
-        self._fitness = THREAD_POOL.submit(compute_fitness, self.representation, self.chunk)
+        self._start_fitness()
+
+    def fitness_job(self):
+        return compute_fitness, (self.representation, self.chunk)
+
+    @property
+    def genome(self):
+        return representation_to_genome(self.representation, PALETTE_INDEX)
+
+    def cache_key(self):
+        return genome_key(self.genome)
 
     def recombine(self, other):
         a_dict = {}
@@ -252,25 +440,109 @@ class Unit:
             mutated[color] = mutate(self.representation[color])
         return Unit(self.chunk, mutated)
 
-    @property
-    def fitness(self):
-        return self._fitness.result()
-
     def __str__(self):
         all_alleles = 0
         for color in self.representation.keys():
             all_alleles += len(self.representation[color])
         return "{} Genes, {} Fitness".format(all_alleles, self.fitness)
 
-    def __repr__(self):
-        return self.__str__()
 
-    def to_svg(self):
-        return unit_to_svg(self.representation)
+class ArrayUnit(BaseUnit):
+    genome = None
+    parents = ()
+    _state = None
+    _key = None
+
+    def __init__(self, chunk, genome=None, parents=(), resolution=CHUNK_SIZE):
+        self.chunk = chunk
+        self.resolution = resolution
+        if genome is None:
+            self.genome = random_genome(len(COLORS), MAX_INITIAL_GENES, resolution, resolution,
+                                        stroke_reach(resolution))
+        else:
+            self.genome = genome
+        self.parents = parents
+        self._start_fitness()
+
+    def _start_fitness(self):
+        parents, self.parents = self.parents, ()
+        if INCREMENTAL_FITNESS and FITNESS_ENGINE == 'numpy' and parents:
+            fitness = EVALUATOR.lookup(self)
+            if fitness is not None:
+                self.set_fitness(fitness)
+                return
+            if self._delta_fitness(parents):
+                EVALUATOR.record_local()
+                EVALUATOR.remember(self, self.fitness)
+                return
+        super()._start_fitness()
+
+    def _delta_fitness(self, parents):
+        limit = DELTA_MAX_FRACTION * max(len(self.genome), 1)
+        for parent in parents:
+            removed, added = genome_diff(parent.genome, self.genome)
+            if len(removed) + len(added) <= limit:
+                distances = chunk_distances(self.chunk, self.resolution)
+                cols = distances.shape[2]
+                self._state = apply_delta(parent.fitness_state(), rasterize_genome(removed, cols),
+                                          rasterize_genome(added, cols), distances)
+                self.set_fitness(self._state.score)
+                return True
+        return False
+
+    def fitness_state(self):
+        # coverage and color score, rebuilt locally for units that were scored by a worker
+        if self._state is None:
+            distances = chunk_distances(self.chunk, self.resolution)
+            self._state = fitness_state(*rasterize_genome(self.genome, distances.shape[2]), distances)
+        return self._state
+
+    def fitness_job(self):
+        return compute_packed_fitness, (pack_genome(self.genome), self.chunk, self.resolution)
+
+    def cache_key(self):
+        if self._key is None:
+            self._key = genome_key(self.genome)
+            if self.resolution != CHUNK_SIZE:
+                self._key = (self.resolution, self._key)
+        return self._key
+
+    @property
+    def representation(self):
+        return genome_to_representation(self.genome, COLORS)
+
+    def recombine(self, other):
+        a, b = recombine_genomes(self.genome, other.genome, len(COLORS))
+        return ArrayUnit(self.chunk, a, parents=(self, other), resolution=self.resolution), \
+            ArrayUnit(self.chunk, b, parents=(self, other), resolution=self.resolution)
+
+    def mutate(self):
+        genome = mutate_genome(self.genome, len(COLORS), self.resolution, self.resolution,
+                               stroke_reach(self.resolution))
+        return ArrayUnit(self.chunk, genome, parents=(self,), resolution=self.resolution)
+
+    def upscale(self, resolution):
+        # seed for the next finer level
+        return ArrayUnit(self.chunk, scale_genome(self.genome, self.resolution, resolution, stroke_reach(resolution)),
+                         resolution=resolution)
+
+    def __str__(self):
+        return "{} Genes, {} Fitness".format(len(self.genome), self.fitness)
 
-    def add_to_drawing(self, drawing, inkscape, layers):
-        chunk_pos = chunk_position(self.chunk)
-        return add_to_drawing(drawing, inkscape, layers, self.representation, offset=chunk_pos)
+
+def saved_unit(chunk, genome, fitness):
+    if GENOME == 'array':
+        unit = ArrayUnit(chunk, genome)
+    else:
+        unit = Unit(chunk, genome_to_representation(genome, COLORS))
+    unit.set_fitness(fitness)
+    return unit
+
+
+def new_unit(chunk, resolution=CHUNK_SIZE):
+    if GENOME == 'array':
+        return ArrayUnit(chunk, resolution=resolution)
+    return Unit(chunk)
 
 
 def survivor_selection(pool_size, pool):
@@ -281,22 +553,46 @@ class Population:
     pool = []
     generation = 0
     chunk = 0
+    scale = 1
+    resolution = CHUNK_SIZE
 
-    def __init__(self, chunk, generation=0, pool=None):
+    def __init__(self, chunk, generation=0, pool=None, scale=1, resolution=CHUNK_SIZE):
         self.chunk = chunk
         self.generation = generation
-        pool_size = population_size(self.generation)
+        self.scale = scale
+        self.resolution = resolution
+        pool_size = population_size(self.generation) * self.scale
         if pool is None:
             print("Generating Population {}...".format(chunk))
-            self.pool = [Unit(self.chunk) for _ in range(pool_size)]
+            self.pool = [new_unit(self.chunk, resolution) for _ in range(pool_size)]
         else:
             print("Survivor Selection {}...".format(chunk))
             self.pool = survivor_selection(pool_size, pool)
 
+    @classmethod
+    def restore(cls, chunk, generation, pool, scale=1, resolution=CHUNK_SIZE):
+        # a population made of exactly these units, without survivor selection
+        population = cls.__new__(cls)
+        population.chunk = chunk
+        population.generation = generation
+        population.scale = scale
+        population.resolution = resolution
+        population.pool = pool
+        return population
+
     def next_generation(self):
+        next_pool = self.breed()
+        EVALUATOR.evaluate(next_pool)
+        return self.select(next_pool)
+
+    def breed(self):
+        return breed_populations([self])[0]
+
+    def breed_units(self):
+        # one unit at a time through Unit/ArrayUnit.recombine and mutate
         next_pool = self.pool[:]
         k = parent_tournament_size(self.generation)
-        for _ in range(allowed_to_recombine(self.generation)):
+        for _ in range(allowed_to_recombine(self.generation) * self.scale):
             p1 = k_tournament_selection(self.pool, k)
             p2 = k_tournament_selection(self.pool, k)
             c1, c2 = p1.recombine(p2)
@@ -308,40 +604,480 @@ class Population:
             roll = random.random()
             if roll <= rate:
                 next_pool.append(u.mutate())
+        return self.screen(next_pool)
 
-        return Population(self.chunk, generation=self.generation + 1, pool=next_pool)
+    def screen(self, next_pool):
+        if SURROGATE is None:
+            return next_pool
+        children = next_pool[len(self.pool):]
+        scored = [unit for unit in children if unit.evaluated]
+        unscored = [unit for unit in children if not unit.evaluated]
+        return self.pool + scored + SURROGATE.screen(unscored)
+
+    def select(self, next_pool, scale=None):
+        return Population(self.chunk, generation=self.generation + 1, pool=next_pool,
+                          scale=self.scale if scale is None else scale, resolution=self.resolution)
+
+    def upscale(self, resolution):
+        # the next finer level, seeded with this population's genomes, starting over at generation 0
+        return Population.restore(self.chunk, 0, [unit.upscale(resolution) for unit in self.pool], self.scale,
+                                  resolution)
+
+    def best(self):
+        return max(self.pool, key=lambda x: x.fitness)
 
     def __str__(self):
-        return "Generation {} (Chunk #{}) [ Best {} ]".format(self.generation, self.chunk,
-                                                              max(self.pool, key=lambda x: x.fitness))
+        return "Generation {} (Chunk #{}) [ Best {} ]".format(self.generation, self.chunk, self.best())
 
     def __repr__(self):
         return self.__str__()
 
     def add_best_to_drawing(self, drawing, inkscape, layers):
-        best = max(self.pool, key=lambda x: x.fitness)
-        best.add_to_drawing(drawing, inkscape, layers)
+        self.best().add_to_drawing(drawing, inkscape, layers)
+
+
+def breed_populations(pops):
+    # The offspring pools of several populations. With array genomes the tournaments, crossovers and
+    # mutations of all of them are drawn together by the batched operators, from OPERATOR_RNG.
+    if not BATCHED_OPERATORS or GENOME != 'array' or not pops:
+        return [pop.breed_units() for pop in pops]
+    units = [unit for pop in pops for unit in pop.pool]
+    genomes = [unit.genome for unit in units]
+    sizes = numpy.array([len(pop.pool) for pop in pops])
+    offsets = numpy.cumsum(sizes) - sizes
+    pairs = numpy.array([allowed_to_recombine(pop.generation) * pop.scale for pop in pops])
+    k = numpy.array([parent_tournament_size(pop.generation) for pop in pops])
+    winners = tournament_winners(numpy.array([unit.fitness for unit in units]), offsets, sizes, pairs * 2, k,
+                                 OPERATOR_RNG)
+    children = crossover_genomes(genomes, winners[0::2], winners[1::2], len(COLORS), OPERATOR_RNG)
+
+    rates = numpy.repeat([mutation_rate(pop.generation) for pop in pops], sizes)
+    mutants = numpy.flatnonzero(OPERATOR_RNG.random(len(units)) <= rates)
+    resolutions = numpy.array([units[i].resolution for i in mutants], dtype=numpy.intp)
+    mutated = mutate_genomes([genomes[i] for i in mutants], len(COLORS), resolutions, resolutions,
+                             numpy.array([stroke_reach(r) for r in resolutions], dtype=numpy.intp), OPERATOR_RNG)
+
+    pools = []
+    pair = 0
+    mutant = 0
+    for pop, end, count in zip(pops, offsets + sizes, pairs):
+        next_pool = pop.pool[:]
+        for _ in range(count):
+            parents = (units[winners[2 * pair]], units[winners[2 * pair + 1]])
+            next_pool.append(ArrayUnit(pop.chunk, children[2 * pair], parents=parents, resolution=pop.resolution))
+            next_pool.append(ArrayUnit(pop.chunk, children[2 * pair + 1], parents=parents,
+                                       resolution=pop.resolution))
+            pair += 1
+        while mutant < len(mutants) and mutants[mutant] < end:
+            next_pool.append(ArrayUnit(pop.chunk, mutated[mutant], parents=(units[mutants[mutant]],),
+                                       resolution=pop.resolution))
+            mutant += 1
+        pools.append(pop.screen(next_pool))
+    return pools
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Evolve a line drawing of {} chunk by chunk".format(SOURCE_IMAGE))
+    parser.add_argument('--generations', type=int, default=100)
+    parser.add_argument('--mode', choices=('generational', 'steady', 'islands'), default='generational',
+                        help="generational waits for every chunk each generation, steady breeds each chunk "
+                             "again as soon as its offspring are scored, islands runs groups of chunks "
+                             "entirely inside the workers")
+    parser.add_argument('--migrate-every', type=int, default=MIGRATE_EVERY, metavar='K',
+                        help="islands mode: generations between migrations of best genomes to adjacent chunks")
+    parser.add_argument('--seed', type=int, default=None,
+                        help="seed the random streams for a reproducible run")
+    parser.add_argument('--adaptive', action='store_true',
+                        help="retire chunks that stopped improving and give their share to the ones that still do")
+    parser.add_argument('--budget', type=int, default=None,
+                        help="stop after this many offspring evaluations in total (implies --adaptive)")
+    parser.add_argument('--log', default='tmp/run.jsonl',
+                        help="run log of every generation's changed chunks, see replay.py")
+    parser.add_argument('--snapshot-every', type=int, default=None, metavar='N',
+                        help="also write tmp/gen-N.svg every N generations; by default only the last one")
+    parser.add_argument('--snapshot-seconds', type=float, default=None, metavar='T',
+                        help="write a snapshot at most every T seconds instead")
+    parser.add_argument('--checkpoint', default='tmp/checkpoint.npz',
+                        help="populations, fitness and RNG state are saved here, see --resume")
+    parser.add_argument('--checkpoint-every', type=int, default=10, metavar='N',
+                        help="checkpoint every N generations as well as when the run ends or is interrupted")
+    parser.add_argument('--resume', action='store_true', help="continue the run saved in --checkpoint")
+    parser.add_argument('--levels', type=int, nargs='*', default=[], metavar='SIZE',
+                        help="evolve on chunks box-filtered down to these sizes first, coarsest first, each "
+                             "level seeding the next; --generations then counts full resolution generations")
+    parser.add_argument('--level-generations', type=int, default=20, metavar='N',
+                        help="generations spent at each coarse level")
+    parser.add_argument('--surrogate-keep', type=float, default=None, metavar='FRACTION',
+                        help="score offspring with a cheap surrogate first and only score this fraction exactly")
+    parser.add_argument('--surrogate-audit', type=float, default=SURROGATE_AUDIT_RATE, metavar='RATE',
+                        help="share of screened batches also scored exactly to measure the surrogate")
+    args = parser.parse_args(argv)
+    if args.levels and GENOME != 'array':
+        parser.error("--levels needs GENOME = 'array'")
+    if any(not 0 < resolution < CHUNK_SIZE for resolution in args.levels):
+        parser.error("--levels must be between 1 and {}".format(CHUNK_SIZE - 1))
+    if args.mode == 'islands' and (args.adaptive or args.budget is not None):
+        parser.error("--mode islands does not support --adaptive or --budget")
+    if args.mode == 'islands' and GENOME != 'array':
+        parser.error("--mode islands needs GENOME = 'array'")
+    if args.surrogate_keep is not None and not 0 < args.surrogate_keep <= 1:
+        parser.error("--surrogate-keep must be in (0, 1]")
+    return args
+
+
+def best_units(pops):
+    # the state a snapshot needs; units are never changed once bred, so the writer can keep them
+    return [pop.best() for pop in pops]
+
+
+def write_snapshot(generation, units):
+    grid = chunk_grid()
+    save_drawing('tmp/gen-{}.svg'.format(generation), (grid.width, grid.height),
+                 [(unit.representation, chunk_position(unit.chunk)) for unit in units])
+
+
+def advance(pops, chunk, pool, scheduler):
+    # select the next population of one chunk from its scored pool
+    offspring = len(pool) - len(pops[chunk].pool)
+    scale = None if scheduler is None else scheduler.scale(chunk)
+    pops[chunk] = pops[chunk].select(pool, scale=scale)
+    if scheduler is not None:
+        scheduler.record(chunk, pops[chunk].best().fitness, offspring)
+
+
+def capture_checkpoint(pops, scheduler):
+    return Checkpoint([pop.pool[:] for pop in pops], [pop.generation for pop in pops], [pop.scale for pop in pops],
+                      {'random': random.getstate(), 'operators': OPERATOR_RNG.bit_generator.state,
+                       'scheduler': None if scheduler is None else scheduler.state()})
+
+
+def restore_checkpoint(checkpoint):
+    pops = [Population.restore(chunk, generation, [saved_unit(chunk, *unit) for unit in pool], scale)
+            for chunk, (pool, generation, scale) in enumerate(zip(checkpoint.pools, checkpoint.generations,
+                                                                  checkpoint.scales))]
+    version, internal, gauss = checkpoint.state['random']
+    random.setstate((version, tuple(internal), gauss))
+    if 'operators' in checkpoint.state:
+        OPERATOR_RNG.bit_generator.state = checkpoint.state['operators']
+    return pops
+
+
+def coarse_to_fine(levels, generations):
+    # Evolves every chunk at each coarse level in turn and seeds each finer level by scaling the
+    # survivors' endpoints up. Returns the full resolution populations, scored and at generation 0.
+    pops = None
+    for resolution in list(levels) + [CHUNK_SIZE]:
+        if pops is None:
+            pops = [Population(chunk, resolution=resolution) for chunk in range(len(targets()))]
+        else:
+            pops = [pop.upscale(resolution) for pop in pops]
+        EVALUATOR.evaluate([unit for pop in pops for unit in pop.pool])
+        if resolution == CHUNK_SIZE:
+            return pops
+        print("Level {0}x{0}".format(resolution))
+        run_generational(pops, generations, None, lambda generation: None)
 
 
-def main():
+def rate_report(evaluations, seconds):
+    return "{} evaluations in {:.2f}s ({:.0f} evaluations/s)".format(evaluations, seconds,
+                                                                   evaluations / seconds if seconds else 0.0)
+
+
+def run_generational(pops, generations, scheduler, observe):
     sw = Stopwatch()
     sw.start()
-    try:
-        os.makedirs("./tmp", exist_ok=True)
-        pops = [Population(i) for i in range(374)]
-        print("Gen 0 took {} to init".format(sw.reset()))
-        for i in range(100):
+    total = 0
+    # a resumed run carries on from the generation it was checkpointed at
+    for i in range(max(pop.generation for pop in pops), generations):
+        print(pops)
+        observe(i)
+
+        # breed every chunk first so a whole generation's offspring is scored in one pass
+        chunks = range(len(pops)) if scheduler is None else scheduler.active()
+        pools = dict(zip(chunks, breed_populations([pops[chunk] for chunk in chunks])))
+        EVALUATOR.evaluate([unit for pool in pools.values() for unit in pool])
+        for chunk, pool in pools.items():
+            advance(pops, chunk, pool, scheduler)
+        # audit scores count towards the generation that screened them
+        if SURROGATE is not None:
+            SURROGATE.audit(EVALUATOR.evaluate)
+        seconds = sw.reset()
+        total += EVALUATOR.evaluations
+        print("Next gen took {}".format(seconds))
+        print(rate_report(EVALUATOR.evaluations, seconds))
+        print(EVALUATOR.report())
+        EVALUATOR.reset_stats()
+        if SURROGATE is not None:
+            print(SURROGATE.report())
+        if scheduler is not None:
+            scheduler.step()
+            print(scheduler.report())
+            if scheduler.done():
+                break
+    return total
+
+
+def run_steady_state(pops, generations, scheduler, observe):
+    # Every chunk population advances on its own: as soon as a chunk's offspring are scored it selects
+    # and breeds again, so the pool always has batches queued instead of draining at a generation
+    # barrier. Offspring of chunks that become ready together share one submission of at least
+    # STEADY_BATCH_UNITS units, since one small task per chunk swamps the pool's feeder threads.
+    # A round ends when the slowest running chunk completes another generation. Batches straddle
+    # rounds, so throughput and worker utilization are only reported for the whole run.
+    sw = Stopwatch()
+    sw.start()
+    run_start = time.perf_counter()
+    in_flight = {}
+    bred = []
+    # futures report themselves here when done; wait() on every future per completion is quadratic
+    finished = queue.Queue()
+
+    def launch(chunk):
+        if pops[chunk].generation >= generations:
+            return
+        if scheduler is not None and (chunk in scheduler.retired or scheduler.done()):
+            return
+        bred.append((chunk, pops[chunk].breed()))
+
+    def submit(pools):
+        future = EVALUATOR.submit([unit for _, pool in pools for unit in pool])
+        if future is None:
+            # every offspring was already in the cache
+            for chunk, pool in pools:
+                advance(pops, chunk, pool, scheduler)
+                launch(chunk)
+            return
+        in_flight[future] = pools
+        future.add_done_callback(finished.put)
+
+    def flush(force=False):
+        # submit bred pools in groups of STEADY_BATCH_UNITS; the remainder waits unless the pool would idle
+        group = []
+        units = 0
+        while bred:
+            chunk, pool = bred.pop(0)
+            group.append((chunk, pool))
+            units += len(pool)
+            if units >= STEADY_BATCH_UNITS or (force and not bred):
+                submit(group)
+                group = []
+                units = 0
+        bred.extend(group)
+
+    completed_round = min((pop.generation for pop in pops if scheduler is None or pop.chunk not in scheduler.retired),
+                          default=generations)
+    print(pops)
+    observe(completed_round)
+    for chunk in range(len(pops)):
+        launch(chunk)
+    flush(force=True)
+    while in_flight:
+        done = [finished.get()]
+        while not finished.empty():
+            done.append(finished.get())
+        for future in done:
+            EVALUATOR.complete(future)
+            for chunk, pool in in_flight.pop(future):
+                advance(pops, chunk, pool, scheduler)
+                launch(chunk)
+        flush(force=len(in_flight) < WORKERS)
+
+        running = [pops[chunk].generation for pools in in_flight.values() for chunk, _ in pools]
+        running += [pops[chunk].generation for chunk, _ in bred]
+        current_round = min(running, default=generations)
+        if current_round > completed_round:
+            completed_round = current_round
             print(pops)
+            print("Round {} took {}".format(completed_round, sw.reset()))
+            if SURROGATE is not None:
+                SURROGATE.audit(EVALUATOR.evaluate)
+                print(SURROGATE.report())
+            if scheduler is not None:
+                scheduler.step()
+                print(scheduler.report())
+            observe(completed_round)
+    seconds = time.perf_counter() - run_start
+    EVALUATOR.record_wall(seconds)
+    print(rate_report(EVALUATOR.evaluations, seconds))
+    print(EVALUATOR.report())
+    return EVALUATOR.evaluations
+
+
+def pack_island(pops):
+    return [(pop.chunk, pop.generation, pop.scale, pop.resolution,
+             [(pack_genome(unit.genome), unit.fitness if unit.evaluated else None) for unit in pop.pool])
+            for pop in pops]
+
+
+def unpack_island(island):
+    pops = []
+    for chunk, generation, scale, resolution, pool in island:
+        units = []
+        for genome_bytes, fitness in pool:
+            # frombuffer views are read-only; units own a writable copy
+            unit = ArrayUnit(chunk, unpack_genome(genome_bytes).copy(), resolution=resolution)
+            if fitness is not None:
+                unit.set_fitness(fitness)
+            units.append(unit)
+        pops.append(Population.restore(chunk, generation, units, scale, resolution))
+    return pops
+
+
+def evolve_island(island, generations, seed):
+    # Runs in a worker: the whole GA for a group of chunks, `generations` generations in a row, scored in
+    # this process. Fitness is local here, so children are scored incrementally from their parents.
+    global EVALUATOR, INCREMENTAL_FITNESS, OPERATOR_RNG
+    if not isinstance(EVALUATOR.pool, InlineExecutor):
+        EVALUATOR = BatchEvaluator(InlineExecutor(), 1, cache=FitnessCache(size=FITNESS_CACHE.size))
+    INCREMENTAL_FITNESS = True
+    random.seed(seed)
+    OPERATOR_RNG = numpy.random.default_rng(seed)
+    EVALUATOR.reset_stats()
+    start = time.perf_counter()
+    pops = unpack_island(island)
+    # migrants arrive unscored
+    EVALUATOR.evaluate([unit for pop in pops for unit in pop.pool])
+    for _ in range(generations):
+        pools = breed_populations(pops)
+        EVALUATOR.evaluate([unit for pool in pools for unit in pool])
+        pops = [pop.select(pool) for pop, pool in zip(pops, pools)]
+        if SURROGATE is not None:
+            SURROGATE.audit(EVALUATOR.evaluate)
+    return pack_island(pops), EVALUATOR.evaluations, time.perf_counter() - start
+
+
+def neighbours(chunk):
+    # chunks of the same image sharing an edge with `chunk` in the column-major grid
+    index, local = chunk_source(chunk)
+    grid = chunk_grids()[index]
+    column, row = divmod(local, grid.rows)
+    if row > 0:
+        yield chunk - 1
+    if row < grid.rows - 1:
+        yield chunk + 1
+    if column > 0:
+        yield chunk - grid.rows
+    if column < grid.columns - 1:
+        yield chunk + grid.rows
+
+
+def migrate(pops):
+    # Every chunk receives the best genome of each neighbour. Genomes are in chunk-local coordinates, so
+    # moving a drawing from its chunk_position to the neighbour's keeps its rows as they are.
+    best = [pop.best() for pop in pops]
+    for pop in pops:
+        pop.pool = pop.pool + [ArrayUnit(pop.chunk, best[other].genome.copy(), resolution=pop.resolution)
+                               for other in neighbours(pop.chunk)]
+
+
+def run_islands(pops, generations, scheduler, observe, migrate_every=MIGRATE_EVERY):
+    # Groups of neighbouring chunks evolve inside the workers for migrate_every generations at a time;
+    # between epochs the main process only exchanges best genomes between adjacent chunks.
+    sw = Stopwatch()
+    sw.start()
+    total = 0
+    count = WORKERS * ISLANDS_PER_WORKER
+    groups = [range(i * len(pops) // count, (i + 1) * len(pops) // count) for i in range(count)]
+    start = generation = max(pop.generation for pop in pops)
+    while generation < generations:
+        print(pops)
+        observe(generation)
+        if generation > start:
+            migrate(pops)
+        epoch = min(migrate_every, generations - generation)
+        futures = [THREAD_POOL.submit(evolve_island, pack_island([pops[chunk] for chunk in group]), epoch,
+                                      random.getrandbits(64))
+                   for group in groups if group]
+        evaluations = 0
+        busy = 0.0
+        for future in futures:
+            island, island_evaluations, island_busy = future.result()
+            for pop in unpack_island(island):
+                pops[pop.chunk] = pop
+            evaluations += island_evaluations
+            busy += island_busy
+        generation += epoch
+        seconds = sw.reset()
+        total += evaluations
+        print("Generations {}-{} took {}".format(generation - epoch, generation - 1, seconds))
+        print(rate_report(evaluations, seconds))
+        print("worker utilization {:.0%}".format(busy / (seconds * WORKERS) if seconds else 0.0))
+    return total
+
+
+def main(argv=None):
+    global SURROGATE, OPERATOR_RNG
+    args = parse_args(argv)
+    if args.seed is not None:
+        random.seed(args.seed)
+        OPERATOR_RNG = numpy.random.default_rng(args.seed)
+    if args.surrogate_keep is not None:
+        SURROGATE = SurrogateScreen(surrogate_fitness, args.surrogate_keep, audit_rate=args.surrogate_audit)
+    sw = Stopwatch()
+    sw.start()
+    pops = None
+    log = None
+    scheduler = None
+    # the state at the start of the current generation, saved if the run is interrupted
+    boundary = None
+    writer = SnapshotWriter(write_snapshot, every=args.snapshot_every, interval=args.snapshot_seconds)
+
+    def observe(generation):
+        nonlocal boundary
+        units = best_units(pops)
+        log.record(generation, units)
+        writer.offer(generation, lambda: units)
+        boundary = capture_checkpoint(pops, scheduler)
+        if args.checkpoint_every and generation % args.checkpoint_every == 0:
+            boundary.save(args.checkpoint)
 
-            drawing = svgwrite.Drawing(size=(550, 425), filename='tmp/gen-{}.svg'.format(i))
-            inkscape = Inkscape(drawing)
-            layers = {}
-            [pop.add_best_to_drawing(drawing, inkscape, layers) for pop in pops]
-            drawing.save(pretty=True, indent=2)
-
-            pops = [pop.next_generation() for pop in pops]
-            print("Next gen took {}".format(sw.reset()))
+    try:
+        os.makedirs("./tmp", exist_ok=True)
+        # publish (or map) the targets and their distance tables before any worker needs them
+        distance_tables()
+        checkpoint = Checkpoint.load(args.checkpoint) if args.resume else None
+        if checkpoint is not None:
+            pops = restore_checkpoint(checkpoint)
+            print("Resumed at generation {} from {}".format(max(pop.generation for pop in pops), args.checkpoint))
+        elif args.levels:
+            for resolution in args.levels:
+                distance_tables(resolution)
+            pops = coarse_to_fine(args.levels, args.level_generations)
+            print("Coarse levels took {}".format(sw.reset()))
+        else:
+            pops = [Population(i) for i in range(len(targets()))]
+            EVALUATOR.evaluate([unit for pop in pops for unit in pop.pool])
+            print("Gen 0 took {} to init".format(sw.reset()))
+        EVALUATOR.reset_stats()
+        grid = chunk_grid()
+        log = RunLog(args.log, {'source': SOURCE_IMAGE, 'chunk_size': CHUNK_SIZE, 'width': grid.width,
+                                'height': grid.height, 'rows': grid.rows, 'columns': grid.columns,
+                                'palette': COLORS}, append=args.resume)
+        if args.adaptive or args.budget is not None:
+            scheduler = ChunkScheduler(range(len(pops)), budget=args.budget)
+            if checkpoint is not None and checkpoint.state['scheduler'] is not None:
+                scheduler.restore(checkpoint.state['scheduler'])
+        if args.mode == 'islands':
+            evaluations = run_islands(pops, args.generations, scheduler, observe, migrate_every=args.migrate_every)
+        else:
+            run = run_steady_state if args.mode == 'steady' else run_generational
+            evaluations = run(pops, args.generations, scheduler, observe)
+        print("{} mode: {}".format(args.mode, rate_report(evaluations, sw.duration())))
+        boundary = capture_checkpoint(pops, scheduler)
     finally:
+        if boundary is not None:
+            boundary.save(args.checkpoint)
+        # the final state is always written, however the run ended
+        if pops is None:
+            writer.close()
+        else:
+            generation = max(pop.generation for pop in pops)
+            units = best_units(pops)
+            if log is not None:
+                log.record(generation, units)
+                log.close()
+            writer.close(generation, units)
+        print(writer.report())
         THREAD_POOL.shutdown()
 
 
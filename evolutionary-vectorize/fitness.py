@@ -0,0 +1,114 @@
+import numpy
+
+from colorsci import delta_e_cie2000, palette_lab, srgb_to_lab
+from genome import genome_segments
+from raster import segment_pts
+
+NO_GENES_FITNESS = -1e128
+OVERLAP_PENALTY = 1000
+COLOR_REWARD = 50
+
+
+def palette_distances(target, palette, lut=None, target_lab=None):
+    # (len(palette), rows, cols) table of the distance from every palette color to every target pixel
+    if lut is not None:
+        return numpy.moveaxis(lut.distances(target), -1, 0).astype(numpy.float64)
+    if target_lab is None:
+        target_lab = srgb_to_lab(target)
+    return delta_e_cie2000(palette_lab(palette)[:, None, None, :], target_lab[None, :, :, :])
+
+
+def rasterize(representation, palette_index, cols):
+    # Flatten a representation into per-stroke palette indices, per-stroke pixel counts and the
+    # concatenated flat pixel indices of every stroke.
+    stroke_colors = []
+    stroke_pts = []
+    for color, alleles in representation.items():
+        idx = palette_index[color]
+        for allele in alleles:
+            stroke_colors.append(idx)
+            stroke_pts.append(segment_pts(allele.start, allele.end))
+    return _flatten(stroke_colors, stroke_pts, cols)
+
+
+def rasterize_genome(genome, cols):
+    stroke_pts = [segment_pts(start, end) for start, end in genome_segments(genome)]
+    return _flatten(genome['color'], stroke_pts, cols)
+
+
+def _flatten(stroke_colors, stroke_pts, cols):
+    if not stroke_pts:
+        return numpy.zeros(0, dtype=numpy.intp), numpy.zeros(0, dtype=numpy.intp), numpy.zeros(0, dtype=numpy.intp)
+    pts = numpy.concatenate(stroke_pts)
+    return (numpy.array(stroke_colors, dtype=numpy.intp),
+            numpy.array([len(p) for p in stroke_pts], dtype=numpy.intp),
+            pts[:, 0] * cols + pts[:, 1])
+
+
+def coverage_canvas(pixels, size):
+    return numpy.bincount(pixels, minlength=size)
+
+
+class FitnessState:
+    # Everything needed to rescore a unit after a few strokes change: the stroke count, the summed
+    # color reward and the per-pixel coverage counts.
+    __slots__ = ('strokes', 'color_score', 'coverage')
+
+    def __init__(self, strokes, color_score, coverage):
+        self.strokes = strokes
+        self.color_score = color_score
+        self.coverage = coverage
+
+    @property
+    def score(self):
+        if self.strokes == 0:
+            return NO_GENES_FITNESS
+        score = self.color_score
+        score -= OVERLAP_PENALTY * numpy.sum(numpy.maximum(self.coverage - 1, 0))
+        score -= numpy.count_nonzero(self.coverage == 0)
+        return float(score)
+
+
+def _color_score(stroke_colors, stroke_lengths, pixels, flat):
+    colors = numpy.repeat(stroke_colors, stroke_lengths)
+    return numpy.sum(COLOR_REWARD - flat[colors, pixels])
+
+
+def fitness_state(stroke_colors, stroke_lengths, pixels, distances):
+    flat = distances.reshape(distances.shape[0], -1)
+    return FitnessState(len(stroke_colors), _color_score(stroke_colors, stroke_lengths, pixels, flat),
+                        coverage_canvas(pixels, flat.shape[1]))
+
+
+def apply_delta(state, removed, added, distances):
+    # New state after taking the rasterized `removed` strokes away from `state` and adding `added`
+    flat = distances.reshape(distances.shape[0], -1)
+    color_score = state.color_score
+    coverage = state.coverage.copy()
+    for sign, (stroke_colors, stroke_lengths, pixels) in ((-1, removed), (1, added)):
+        if len(stroke_colors):
+            color_score += sign * _color_score(stroke_colors, stroke_lengths, pixels, flat)
+            coverage += sign * coverage_canvas(pixels, flat.shape[1])
+    return FitnessState(state.strokes - len(removed[0]) + len(added[0]), color_score, coverage)
+
+
+def score_strokes(stroke_colors, stroke_lengths, pixels, distances):
+    return fitness_state(stroke_colors, stroke_lengths, pixels, distances).score
+
+
+def surrogate_scores(genomes, distances):
+    # Cheap stand-in for the fitness of several genomes of one chunk: each stroke's color reward minus
+    # the pixels left uncovered, as if no two strokes overlapped.
+    flat = distances.reshape(distances.shape[0], -1)
+    counts = numpy.array([len(genome) for genome in genomes], dtype=numpy.intp)
+    scores = numpy.full(len(genomes), NO_GENES_FITNESS)
+    if not counts.sum():
+        return scores
+    stroke_colors, lengths, pixels = rasterize_genome(numpy.concatenate(genomes), distances.shape[2])
+    rewards = COLOR_REWARD - flat[numpy.repeat(stroke_colors, lengths), pixels]
+    stroke_owner = numpy.repeat(numpy.arange(len(genomes)), counts)
+    color_score = numpy.bincount(numpy.repeat(stroke_owner, lengths), weights=rewards, minlength=len(genomes))
+    covered = numpy.bincount(stroke_owner, weights=lengths, minlength=len(genomes))
+    has_genes = counts > 0
+    scores[has_genes] = (color_score - numpy.maximum(flat.shape[1] - covered, 0))[has_genes]
+    return scores
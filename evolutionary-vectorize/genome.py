@@ -0,0 +1,205 @@
+import hashlib
+import random
+from collections import Counter, namedtuple
+
+import numpy
+
+from raster import segment_pts
+
+# One row per stroke; rows are kept grouped by color so every color's sequence is a contiguous slice
+GENE_DTYPE = numpy.dtype([('color', numpy.uint8),
+                          ('x0', numpy.int16), ('y0', numpy.int16),
+                          ('x1', numpy.int16), ('y1', numpy.int16)])
+COORDS = ['x0', 'y0', 'x1', 'y1']
+ROW_BYTES = numpy.dtype((numpy.void, GENE_DTYPE.itemsize))
+
+
+class Stroke(namedtuple('Stroke', 'start end')):
+    # Allele-compatible view of a genome row, used for drawing and the colormath scorer
+    __slots__ = ()
+
+    def allele_pts(self):
+        return set(map(tuple, segment_pts(self.start, self.end).tolist()))
+
+
+def random_genes(color, count, width, height, manhattan):
+    rows = []
+    for _ in range(count):
+        sx, sy = random.randint(0, width - 1), random.randint(0, height - 1)
+        ex = max(min(width - 1, sx + random.randint(-manhattan, manhattan)), 0)
+        ey = max(min(height - 1, sy + random.randint(-manhattan, manhattan)), 0)
+        rows.append((color, sx, sy, ex, ey))
+    return numpy.array(rows, dtype=GENE_DTYPE)
+
+
+def random_genome(palette_size, max_genes, width, height, manhattan):
+    return numpy.concatenate([random_genes(color, random.randint(0, max_genes), width, height, manhattan)
+                              for color in range(palette_size)])
+
+
+def color_bounds(genome, palette_size):
+    return numpy.searchsorted(genome['color'], numpy.arange(palette_size + 1)).tolist()
+
+
+def color_sequences(genome, palette_size):
+    # per-color lists of row tuples; small per-color array operations cost far more than plain lists
+    rows = genome.tolist()
+    bounds = color_bounds(genome, palette_size)
+    return [rows[bounds[color]:bounds[color + 1]] for color in range(palette_size)]
+
+
+def k_crossover_genes(k, genes1, genes2):
+    if k == 0:
+        return genes1, genes2
+
+    split_s1 = random.randint(0, len(genes1))
+    split_s2 = random.randint(0, len(genes2))
+
+    p0, p1 = genes1[0:split_s1], genes1[split_s1:]
+    q0, q1 = genes2[0:split_s2], genes2[split_s2:]
+
+    return k_crossover_genes(k - 1, p0 + q1, q0 + p1)
+
+
+def recombine_genomes(genome1, genome2, palette_size):
+    crossovers = random.randint(1, 4)
+    a_rows = []
+    b_rows = []
+    for genes1, genes2 in zip(color_sequences(genome1, palette_size), color_sequences(genome2, palette_size)):
+        a, b = k_crossover_genes(crossovers, genes1, genes2)
+        # the dict genome dropped repeated alleles with set(); here equal rows are merged
+        a_rows.extend(dict.fromkeys(a))
+        b_rows.extend(dict.fromkeys(b))
+    return numpy.array(a_rows, dtype=GENE_DTYPE), numpy.array(b_rows, dtype=GENE_DTYPE)
+
+
+def random_row(color, width, height, manhattan):
+    return random_genes(color, 1, width, height, manhattan).tolist()[0]
+
+
+def mutate_genes(color, genes, width, height, manhattan):
+    res = genes[:]
+    action = random.choice(['REPLACE', 'DELETE', 'ADD'])
+    idx = random.randint(0, len(genes))
+
+    if action == 'REPLACE' and idx < len(res):
+        res[idx] = random_row(color, width, height, manhattan)
+    elif action == 'DELETE' and idx < len(res):
+        res.pop(idx)
+    else:
+        res.insert(idx, random_row(color, width, height, manhattan))
+    return res
+
+
+def mutate_genome(genome, palette_size, width, height, manhattan):
+    rows = []
+    for color, genes in enumerate(color_sequences(genome, palette_size)):
+        rows.extend(mutate_genes(color, genes, width, height, manhattan))
+    return numpy.array(rows, dtype=GENE_DTYPE)
+
+
+def genome_diff(parent, child):
+    # (rows only in parent, rows only in child), counting repeated rows as a multiset
+    parent_rows = parent.tolist()
+    child_rows = child.tolist()
+    before = set(parent_rows)
+    after = set(child_rows)
+    if len(before) == len(parent_rows) and len(after) == len(child_rows):
+        removed, added = before - after, after - before
+    else:
+        before, after = Counter(parent_rows), Counter(child_rows)
+        removed, added = (before - after).elements(), (after - before).elements()
+    return numpy.array(list(removed), dtype=GENE_DTYPE), numpy.array(list(added), dtype=GENE_DTYPE)
+
+
+def drop_overlaps(genome):
+    # Keeps rows in order, skipping any whose pixels touch an earlier kept row
+    covered = set()
+    keep = []
+    for i, (x0, y0, x1, y1) in enumerate(genome[COORDS].tolist()):
+        pts = set(map(tuple, segment_pts((x0, y0), (x1, y1)).tolist()))
+        if not pts & covered:
+            covered |= pts
+            keep.append(i)
+    return genome[keep]
+
+
+def split_row(row, reach):
+    # A row cut into consecutive pieces reaching at most `reach` along each axis. Pieces cover adjacent,
+    # disjoint spans of the row's longer axis, so their pixels never touch each other.
+    color, x0, y0, x1, y1 = row
+    if max(abs(x1 - x0), abs(y1 - y0)) <= reach:
+        return [row]
+    swap = abs(y1 - y0) > abs(x1 - x0)
+    if swap:
+        x0, y0, x1, y1 = y0, x0, y1, x1
+    step = 1 if x1 >= x0 else -1
+
+    def minor(x):
+        return int(round(y0 + (y1 - y0) * (x - x0) / (x1 - x0)))
+
+    pieces = []
+    for start in range(x0, x1 + step, (reach + 1) * step):
+        end = start + reach * step
+        end = min(end, x1) if step > 0 else max(end, x1)
+        piece = (start, minor(start), end, minor(end))
+        pieces.append((color, piece[1], piece[0], piece[3], piece[2]) if swap else (color,) + piece)
+    return pieces
+
+
+def scale_genome(genome, source_size, target_size, reach):
+    # Moves rows from a source_size square onto a target_size one. Each source pixel covers a block of
+    # target pixels, so every row becomes as many parallel rows as it takes to fill the blocks its
+    # endpoints sit in, and a stroke keeps the area it covered. Rows longer than `reach` along an axis
+    # are split into pieces like the strokes random_genome and mutate_genome make, then rows whose
+    # pixels would touch an earlier row are dropped.
+    def block(c):
+        return c * target_size // source_size, (c + 1) * target_size // source_size - 1
+
+    rows = []
+    for color, x0, y0, x1, y1 in genome.tolist():
+        (sx0, ex0), (sy0, ey0), (sx1, ex1), (sy1, ey1) = block(x0), block(y0), block(x1), block(y1)
+        if abs(x1 - x0) >= abs(y1 - y0):
+            # mostly horizontal: stretch along x, stack copies along y
+            fx0, fx1 = (sx0, ex1) if x0 <= x1 else (ex0, sx1)
+            for k in range(max(ey0 - sy0, ey1 - sy1) + 1):
+                rows.append((color, fx0, min(sy0 + k, ey0), fx1, min(sy1 + k, ey1)))
+        else:
+            fy0, fy1 = (sy0, ey1) if y0 <= y1 else (ey0, sy1)
+            for k in range(max(ex0 - sx0, ex1 - sx1) + 1):
+                rows.append((color, min(sx0 + k, ex0), fy0, min(sx1 + k, ex1), fy1))
+    scaled = numpy.array([piece for row in rows for piece in split_row(row, reach)], dtype=GENE_DTYPE)
+    return drop_overlaps(scaled[numpy.argsort(scaled['color'], kind='stable')])
+
+
+def genome_to_representation(genome, palette):
+    representation = {color: [] for color in palette}
+    for c, x0, y0, x1, y1 in genome.tolist():
+        representation[palette[c]].append(Stroke((x0, y0), (x1, y1)))
+    return representation
+
+
+def representation_to_genome(representation, palette_index):
+    rows = [(palette_index[color], allele.start[0], allele.start[1], allele.end[0], allele.end[1])
+            for color, alleles in representation.items() for allele in alleles]
+    genome = numpy.array(rows, dtype=GENE_DTYPE)
+    return genome[numpy.argsort(genome['color'], kind='stable')]
+
+
+def genome_key(genome):
+    # Canonical hash of the multiset of rows: row order does not matter, repeated rows do
+    return hashlib.blake2b(numpy.sort(genome.view(ROW_BYTES)).tobytes(), digest_size=16).digest()
+
+
+def pack_genome(genome):
+    # raw row bytes; far smaller to pickle than the array with its structured dtype
+    return genome.tobytes()
+
+
+def unpack_genome(data):
+    return numpy.frombuffer(data, dtype=GENE_DTYPE)
+
+
+def genome_segments(genome):
+    # ((x0, y0), (x1, y1)) tuples of every row, in row order
+    return [((x0, y0), (x1, y1)) for x0, y0, x1, y1 in genome[COORDS].tolist()]
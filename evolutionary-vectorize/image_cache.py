@@ -0,0 +1,109 @@
+import hashlib
+import os
+
+import numpy
+from PIL import Image
+
+CACHE_DIR = os.environ.get('IMAGE_CACHE_DIR', 'cache')
+# rows converted to the cached mode at a time
+CONVERT_ROWS = 1024
+# largest source decoded whole; uncompressed sources of any size are read a band of rows at a time
+MAX_DECODE_PIXELS = 1 << 27
+
+
+def image_key(path, mode):
+    # names, sizes and mtimes, like the target store keys, so a changed source is converted again
+    stat = os.stat(path)
+    digest = hashlib.sha1('{}:{}:{}:{}'.format(os.path.abspath(path), stat.st_size, stat.st_mtime_ns,
+                                               mode).encode())
+    return digest.hexdigest()[:16]
+
+
+def cached_image(path, mode='RGB', cache_dir=CACHE_DIR):
+    # Read-only memory map of the pixels of `path` in PIL `mode`, (rows, columns) or (rows, columns,
+    # bands) uint8. The source is decoded once, by the first process to ask, and kept in cache_dir as
+    # .npy; after that every process only maps the file and pages in the windows it slices. A .npy
+    # source is mapped as it is.
+    if path.endswith('.npy'):
+        return numpy.load(path, mmap_mode='r')
+    cache_path = os.path.join(cache_dir, 'image-{}.npy'.format(image_key(path, mode)))
+    if not os.path.exists(cache_path):
+        _convert(path, mode, cache_path)
+    return numpy.load(cache_path, mmap_mode='r')
+
+
+def _row_bytes(tile, width):
+    # bytes per row of an uncompressed top-down tile, or None when its rows cannot be read on their own
+    rawmode, stride, orientation = (tile[3], 0, 1) if isinstance(tile[3], str) else tile[3][:3]
+    if orientation != 1 or rawmode == '1' or ';' in rawmode:
+        return None
+    try:
+        pixel_bytes = len(Image.new(rawmode, (1, 1)).tobytes())
+    except ValueError:
+        return None
+    return stride or pixel_bytes * width
+
+
+def strip_tiles(image):
+    # (tile, row bytes) of every tile when the source is stored uncompressed, so any band of rows can be
+    # read straight from the file; None when it has to be decoded whole
+    if image.format == 'TIFF' and image.tag_v2.get(274, 1) != 1:
+        # PIL rotates oriented TIFFs after loading them
+        return None
+    tiles = []
+    for tile in image.tile:
+        x0, y0, x1, y1 = tile[1]
+        row_bytes = _row_bytes(tile, x1 - x0) if tile[0] == 'raw' else None
+        if row_bytes is None:
+            return None
+        tiles.append((tile, row_bytes))
+    return tiles
+
+
+def read_band(f, image, tiles, top, bottom):
+    # rows top to bottom of an image made of strip_tiles, read from the file a tile at a time
+    band = Image.new(image.mode, (image.size[0], bottom - top))
+    if image.mode == 'P':
+        band.putpalette(image.getpalette())
+    for (_, (x0, y0, x1, y1), offset, args), row_bytes in tiles:
+        if y0 < bottom and y1 > top:
+            first, last = max(y0, top), min(y1, bottom)
+            f.seek(offset + (first - y0) * row_bytes)
+            data = f.read((last - first) * row_bytes)
+            args = (args,) if isinstance(args, str) else args
+            band.paste(Image.frombytes(image.mode, (x1 - x0, last - first), data, 'raw', *args), (x0, first - top))
+    return band
+
+
+def _convert(path, mode, cache_path):
+    os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+    with open(path, 'rb') as f:
+        # PIL's pixel limit is replaced by MAX_DECODE_PIXELS below, which only applies to sources that
+        # have to be decoded whole; opening reads only the header
+        limit, Image.MAX_IMAGE_PIXELS = Image.MAX_IMAGE_PIXELS, None
+        try:
+            image = Image.open(f)
+        finally:
+            Image.MAX_IMAGE_PIXELS = limit
+        width, height = image.size
+        tiles = strip_tiles(image)
+        if tiles is None and width * height > MAX_DECODE_PIXELS:
+            raise ValueError("{} is {}x{}, too large to decode in memory; save it as an uncompressed TIFF or "
+                             "a .npy array to read it a strip at a time".format(path, width, height))
+        bands = len(Image.new(mode, (1, 1)).getbands())
+        shape = (height, width) if bands == 1 else (height, width, bands)
+        tmp_path = '{}.{}.tmp'.format(cache_path, os.getpid())
+        pixels = numpy.lib.format.open_memmap(tmp_path, mode='w+', dtype=numpy.uint8, shape=shape)
+        if tiles is None:
+            image.load()
+        for top in range(0, height, CONVERT_ROWS):
+            bottom = min(top + CONVERT_ROWS, height)
+            if tiles is None:
+                pixels[top:bottom] = numpy.asarray(image.crop((0, top, width, bottom)).convert(mode))
+            else:
+                pixels[top:bottom] = numpy.asarray(read_band(f, image, tiles, top, bottom).convert(mode))
+        pixels.flush()
+        del pixels
+        image.close()
+    # atomic publish, so concurrent converters and readers never see a partial image
+    os.replace(tmp_path, cache_path)
@@ -0,0 +1,123 @@
+import numpy
+
+from genome import GENE_DTYPE
+
+MAX_CROSSOVERS = 4
+REPLACE, DELETE, ADD = range(3)
+
+
+# Population-level versions of the genome operators: each call breeds every unit of many populations in a
+# handful of NumPy operations and draws from a numpy.random.Generator. Genomes are color-sorted
+# GENE_DTYPE arrays, handled as one concatenation of rows tagged with the unit they belong to.
+
+
+def _stack(genomes):
+    # every genome's rows back to back and the length of each; joining the raw bytes is much faster than
+    # numpy.concatenate on a structured dtype
+    lengths = numpy.array([len(genome) for genome in genomes], dtype=numpy.intp)
+    return numpy.frombuffer(b''.join([genome.tobytes() for genome in genomes]), dtype=GENE_DTYPE), lengths
+
+
+def _gather(stacked, units):
+    # rows of genome u for every u in units, in that order, and the position in `units` of each row
+    rows, lengths = stacked
+    starts = numpy.cumsum(lengths) - lengths
+    counts = lengths[units]
+    total = counts.sum()
+    owner = numpy.repeat(numpy.arange(len(units)), counts)
+    index = numpy.arange(total) - numpy.repeat(numpy.cumsum(counts) - counts, counts) + numpy.repeat(starts[units],
+                                                                                                    counts)
+    return rows[index], owner
+
+
+def _positions(owner, colors, owners, palette_size):
+    # index of every row within its owner's run of that color, and the (owners, palette_size) run lengths
+    group = owner * palette_size + colors
+    counts = numpy.bincount(group, minlength=owners * palette_size)
+    starts = numpy.cumsum(counts) - counts
+    return numpy.arange(len(group)) - starts[group], counts.reshape(owners, palette_size)
+
+
+def _split(rows, owner, owners):
+    # rows sorted by owner, as one contiguous genome per owner
+    bounds = [0] + numpy.cumsum(numpy.bincount(owner, minlength=owners)).tolist()
+    return [rows[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def random_rows(colors, width, height, manhattan, rng):
+    # one random stroke per entry of `colors`; width, height and manhattan may be per-row arrays
+    count = len(colors)
+    rows = numpy.empty(count, dtype=GENE_DTYPE)
+    rows['color'] = colors
+    sx = rng.integers(0, width, count)
+    sy = rng.integers(0, height, count)
+    rows['x0'] = sx
+    rows['y0'] = sy
+    rows['x1'] = numpy.clip(sx + rng.integers(-manhattan, numpy.add(manhattan, 1), count), 0, numpy.subtract(width, 1))
+    rows['y1'] = numpy.clip(sy + rng.integers(-manhattan, numpy.add(manhattan, 1), count), 0, numpy.subtract(height, 1))
+    return rows
+
+
+def tournament_winners(fitness, offsets, sizes, draws, k, rng):
+    # `draws[i]` tournaments among the sizes[i] units starting at offsets[i], each between k[i] distinct
+    # units; returns the index of every winner
+    owner = numpy.repeat(numpy.arange(len(sizes)), draws)
+    width = sizes.max()
+    # a random permutation of each population, excluded slots sorting last
+    keys = rng.random((len(owner), width))
+    keys[numpy.arange(width)[None, :] >= sizes[owner][:, None]] = 2.0
+    picks = numpy.argsort(keys, axis=1)[:, :numpy.max(k)] + offsets[owner][:, None]
+    entrants = numpy.where(numpy.arange(picks.shape[1])[None, :] < k[owner][:, None], fitness[picks], -numpy.inf)
+    return picks[numpy.arange(len(owner)), numpy.argmax(entrants, axis=1)]
+
+
+def crossover_genomes(genomes, first, second, palette_size, rng, max_crossovers=MAX_CROSSOVERS):
+    # Two children for every pair (first[j], second[j]): each color run of each parent is cut at 1 to
+    # max_crossovers random points (the same count for both parents of a pair) and the alternate
+    # segments go to alternate children. Repeated rows within a child are merged, as in
+    # recombine_genomes. Returns [a0, b0, a1, b1, ...].
+    pairs = len(first)
+    stacked = _stack(genomes)
+    crossovers = rng.integers(1, max_crossovers + 1, pairs)
+    keyed = []
+    for parents, flip in ((first, 0), (second, 1)):
+        rows, owner = _gather(stacked, parents)
+        pos, counts = _positions(owner, rows['color'].astype(numpy.intp), pairs, palette_size)
+        cuts = rng.integers(0, counts[:, :, None] + 1, (pairs, palette_size, max_crossovers))
+        active = numpy.arange(max_crossovers)[None, :] < crossovers[:, None]
+        row_cuts = cuts[owner, rows['color']]
+        parity = numpy.sum((row_cuts <= pos[:, None]) & active[owner], axis=1) % 2
+        keyed.append((rows, owner * 2 + (parity ^ flip)))
+    rows = numpy.concatenate([rows for rows, _ in keyed])
+    child = numpy.concatenate([child for _, child in keyed])
+
+    tagged = numpy.empty(len(rows), dtype=[('child', '>u4'), ('row', GENE_DTYPE)])
+    tagged['child'] = child
+    tagged['row'] = rows
+    # sorting the raw bytes orders by child (big-endian), then color, and brings equal rows together
+    _, first_seen = numpy.unique(tagged.view(numpy.dtype((numpy.void, tagged.dtype.itemsize))), return_index=True)
+    tagged = tagged[first_seen]
+    return _split(numpy.ascontiguousarray(tagged['row']), tagged['child'].astype(numpy.intp), pairs * 2)
+
+
+def mutate_genomes(genomes, palette_size, width, height, manhattan, rng):
+    # mutate_genome for a batch: every color run of every genome gets one REPLACE, DELETE or ADD at a
+    # random index, adding a stroke when the index is past the end. width, height and manhattan may be
+    # per-genome arrays.
+    count = len(genomes)
+    rows, owner = _gather(_stack(genomes), numpy.arange(count))
+    colors = rows['color'].astype(numpy.intp)
+    pos, counts = _positions(owner, colors, count, palette_size)
+    action = rng.integers(0, 3, (count, palette_size))
+    index = rng.integers(0, counts + 1)
+
+    hit = pos == index[owner, colors]
+    keep = ~(hit & (action[owner, colors] != ADD))
+    new_owner, new_color = numpy.nonzero((action != DELETE) | (index == counts))
+    width, height, manhattan = (numpy.broadcast_to(value, count)[new_owner] for value in (width, height, manhattan))
+    added = random_rows(new_color, width, height, manhattan, rng)
+
+    rows = numpy.concatenate((rows[keep], added))
+    owner = numpy.concatenate((owner[keep], new_owner))
+    order = numpy.lexsort((rows['color'], owner))
+    return _split(rows[order], owner[order], count)
@@ -0,0 +1,63 @@
+import hashlib
+import os
+
+import numpy
+
+from colorsci import distance_matrix
+
+CACHE_DIR = os.environ.get('PALETTE_LUT_DIR', 'cache')
+BUILD_BLOCK = 1 << 16
+# Bump when the distance kernel changes so stale tables are not reused
+LUT_VERSION = 1
+
+
+def palette_key(palette, bits):
+    digest = hashlib.sha1(numpy.asarray(palette, dtype=numpy.uint8).tobytes()).hexdigest()[:16]
+    return 'palette-{}-{}bit-v{}'.format(digest, bits, LUT_VERSION)
+
+
+class PaletteLUT:
+    # Distance from every (optionally quantized) 24-bit RGB value to each palette color, built once
+    # per palette and memory-mapped from CACHE_DIR afterwards. Entries are float32, so even bits=8 only
+    # matches the float64 kernel to about 1e-4; fewer bits per channel keep the table small at the cost
+    # of scoring each pixel as the center of its quantization bin. bits=8 is a 2^24-row, 1.4 GB table.
+
+    def __init__(self, palette, bits=8, cache_dir=CACHE_DIR):
+        if not 1 <= bits <= 8:
+            raise ValueError("bits must be between 1 and 8, got {}".format(bits))
+        self.palette = [tuple(int(v) for v in color) for color in palette]
+        self.bits = bits
+        self.shift = 8 - bits
+        self.path = os.path.join(cache_dir, palette_key(self.palette, bits) + '.npy')
+        if not os.path.exists(self.path):
+            self._build()
+        self.table = numpy.load(self.path, mmap_mode='r')
+
+    def _build(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        levels = 1 << self.bits
+        rows = levels ** 3
+        print("Building {}-bit palette lookup table at {}...".format(self.bits, self.path))
+        tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+        table = numpy.lib.format.open_memmap(tmp_path, mode='w+', dtype=numpy.float32,
+                                             shape=(rows, len(self.palette)))
+        # center of each quantization bin; the original value itself when bits == 8
+        centers = numpy.arange(levels) * (1 << self.shift) + ((1 << self.shift) - 1) / 2.0
+        for start in range(0, rows, BUILD_BLOCK):
+            idx = numpy.arange(start, min(start + BUILD_BLOCK, rows))
+            rgb = numpy.stack((centers[idx >> (2 * self.bits)],
+                               centers[(idx >> self.bits) & (levels - 1)],
+                               centers[idx & (levels - 1)]), axis=-1)
+            table[start:start + len(idx)] = distance_matrix(rgb, self.palette)
+        table.flush()
+        del table
+        # atomic publish, so concurrent builders and readers never see a partial table
+        os.replace(tmp_path, self.path)
+
+    def index(self, rgb):
+        rgb = numpy.asarray(rgb, dtype=numpy.intp) >> self.shift
+        return (rgb[..., 0] << (2 * self.bits)) | (rgb[..., 1] << self.bits) | rgb[..., 2]
+
+    def distances(self, rgb):
+        # (..., 3) sRGB -> (..., len(palette)) distances
+        return self.table[self.index(rgb)]
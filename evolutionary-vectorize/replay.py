@@ -0,0 +1,68 @@
+import argparse
+
+import numpy
+from PIL import Image
+
+from drawing import save_drawing
+from genome import GENE_DTYPE, genome_to_representation
+from raster import segment_pts
+from runlog import read_log, replay
+
+
+def chunk_position(header, chunk):
+    return (chunk // header['rows']) * header['chunk_size'], (chunk % header['rows']) * header['chunk_size']
+
+
+def genomes(header, state):
+    for chunk, (_, rows) in sorted(state.items()):
+        yield chunk, numpy.array([tuple(row) for row in rows], dtype=GENE_DTYPE)
+
+
+def write_svg(filename, header, state):
+    palette = [tuple(color) for color in header['palette']]
+    save_drawing(filename, (header['width'], header['height']),
+                 [(genome_to_representation(genome, palette), chunk_position(header, chunk))
+                  for chunk, genome in genomes(header, state)])
+
+
+def write_png(filename, header, state):
+    # strokes painted one color at a time in palette order, the same stacking as the SVG layers
+    image = numpy.full((header['height'], header['width'], 3), 255, dtype=numpy.uint8)
+    placed = list(genomes(header, state))
+    for color_index, color in enumerate(header['palette']):
+        for chunk, genome in placed:
+            ox, oy = chunk_position(header, chunk)
+            for _, x0, y0, x1, y1 in genome[genome['color'] == color_index].tolist():
+                pts = segment_pts((x0 + ox, y0 + oy), (x1 + ox, y1 + oy))
+                inside = (pts[:, 0] >= 0) & (pts[:, 0] < header['width']) & \
+                         (pts[:, 1] >= 0) & (pts[:, 1] < header['height'])
+                image[pts[inside, 1], pts[inside, 0]] = color
+    Image.fromarray(image).save(filename)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild a generation of an evvec.py run from its run log")
+    parser.add_argument('log', help="run log written by evvec.py, e.g. tmp/run.jsonl")
+    parser.add_argument('--generation', type=int, default=None, help="defaults to the last logged generation")
+    parser.add_argument('--svg', default=None)
+    parser.add_argument('--png', default=None)
+    args = parser.parse_args()
+
+    header, records = read_log(args.log)
+    generation = args.generation
+    if generation is None:
+        generation = records[-1]['generation'] if records else 0
+    state = replay(records, generation)
+    svg = args.svg
+    if svg is None and args.png is None:
+        svg = 'tmp/replay-{}.svg'.format(generation)
+    if svg is not None:
+        write_svg(svg, header, state)
+        print("Wrote generation {} to {}".format(generation, svg))
+    if args.png is not None:
+        write_png(args.png, header, state)
+        print("Wrote generation {} to {}".format(generation, args.png))
+
+
+if __name__ == "__main__":
+    main()
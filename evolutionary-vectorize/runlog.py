@@ -0,0 +1,66 @@
+import json
+import os
+
+
+class RunLog:
+    # JSON lines: a header describing the run, then one record per generation holding only the chunks whose
+    # best genome changed since the previous record, as [chunk, fitness, rows] with rows of
+    # [color, x0, y0, x1, y1]. Replaying the records up to a generation rebuilds that generation.
+    # A resumed run appends to the log, starting with a record of every chunk.
+
+    def __init__(self, path, header, append=False):
+        self.path = path
+        self.keys = {}
+        self.generation = None
+        if append and os.path.exists(path):
+            self.file = open(path, 'a')
+        else:
+            self.file = open(path, 'w')
+            self._write(dict(header, type='run'))
+
+    def _write(self, record):
+        self.file.write(json.dumps(record, separators=(',', ':')) + '\n')
+        # a crash leaves every finished generation readable
+        self.file.flush()
+
+    def record(self, generation, units):
+        if generation == self.generation:
+            return 0
+        changed = []
+        for unit in units:
+            key = unit.cache_key()
+            if self.keys.get(unit.chunk) != key:
+                self.keys[unit.chunk] = key
+                changed.append([unit.chunk, float(unit.fitness), unit.genome.tolist()])
+        self._write({'type': 'generation', 'generation': generation, 'changed': changed})
+        self.generation = generation
+        return len(changed)
+
+    def close(self):
+        self.file.close()
+
+
+def read_log(path):
+    # (header, generation records); a line cut short by a crash ends the log
+    records = []
+    with open(path) as f:
+        header = json.loads(f.readline())
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                break
+    return header, records
+
+
+def replay(records, generation=None):
+    # {chunk: (fitness, rows)} of the best genome of every chunk as of `generation`, or of the last record.
+    # Records apply in file order, so after a resume the appended records replace those of the
+    # generations that were run again.
+    state = {}
+    for record in records:
+        if generation is not None and record['generation'] > generation:
+            continue
+        for chunk, fitness, rows in record['changed']:
+            state[chunk] = (fitness, rows)
+    return state
@@ -0,0 +1,81 @@
+PLATEAU_WINDOW = 10
+MIN_IMPROVEMENT = 1.0
+MAX_SCALE = 4
+
+
+class ChunkScheduler:
+    # Tracks the best fitness of every chunk, retires chunks whose best improved by less than
+    # min_improvement over the last `window` generations, and spreads the freed capacity over the chunks
+    # still improving by scaling their populations. Capacity stays at one population per chunk, so the
+    # cost of a generation stays flat; `budget` caps the total number of offspring evaluations.
+
+    def __init__(self, chunks, budget=None, window=PLATEAU_WINDOW, min_improvement=MIN_IMPROVEMENT,
+                 max_scale=MAX_SCALE):
+        self.history = {chunk: [] for chunk in chunks}
+        self.scales = {chunk: 1 for chunk in chunks}
+        self.retired = set()
+        self.budget = budget
+        self.window = window
+        self.min_improvement = min_improvement
+        self.max_scale = max_scale
+        self.capacity = len(self.history)
+        self.spent = 0
+
+    def active(self):
+        return [chunk for chunk in self.history if chunk not in self.retired]
+
+    def scale(self, chunk):
+        return self.scales[chunk]
+
+    def record(self, chunk, best, evaluations):
+        self.history[chunk].append(best)
+        self.spent += evaluations
+
+    def improvement(self, chunk):
+        history = self.history[chunk]
+        if not history:
+            return 0.0
+        return history[-1] - history[max(0, len(history) - 1 - self.window)]
+
+    def step(self):
+        for chunk in self.active():
+            if len(self.history[chunk]) > self.window and self.improvement(chunk) < self.min_improvement:
+                self.retired.add(chunk)
+                self.scales[chunk] = 1
+
+        active = self.active()
+        if not active:
+            return
+        extra = self.capacity - len(active)
+        gains = {chunk: max(self.improvement(chunk), 0.0) for chunk in active}
+        total = sum(gains.values())
+        for chunk in active:
+            share = extra * gains[chunk] / total if total > 0 else extra / len(active)
+            self.scales[chunk] = int(min(self.max_scale, 1 + round(share)))
+
+    def state(self):
+        # JSON-able copy for checkpoints
+        return {'history': [[chunk, list(history)] for chunk, history in self.history.items()],
+                'scales': [[chunk, scale] for chunk, scale in self.scales.items()],
+                'retired': sorted(self.retired), 'spent': self.spent}
+
+    def restore(self, state):
+        self.history = {chunk: history for chunk, history in state['history']}
+        self.scales = {chunk: scale for chunk, scale in state['scales']}
+        self.retired = set(state['retired'])
+        self.spent = state['spent']
+
+    @property
+    def remaining(self):
+        if self.budget is None:
+            return None
+        return max(self.budget - self.spent, 0)
+
+    def done(self):
+        return not self.active() or (self.budget is not None and self.spent >= self.budget)
+
+    def report(self):
+        active = self.active()
+        budget = "" if self.budget is None else " of {}".format(self.budget)
+        return "{} active / {} retired chunks (largest scale {}), {}{} evaluations spent".format(
+            len(active), len(self.retired), max([self.scales[c] for c in active] or [0]), self.spent, budget)
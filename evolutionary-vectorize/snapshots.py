@@ -0,0 +1,66 @@
+import threading
+import time
+
+
+class SnapshotWriter:
+    # Writes snapshots on a background thread so the run never waits on one. offer() hands over the state
+    # of a generation whenever a snapshot is due: every `every` generations, or every `interval` seconds
+    # when an interval is given; never when neither is. The queue holds a single snapshot; one still
+    # waiting when a newer one arrives is dropped. close() always writes the state it is given, then
+    # waits for the writer.
+
+    def __init__(self, render, every=None, interval=None):
+        self.render = render
+        self.every = every
+        self.interval = interval
+        self.written = 0
+        self.dropped = 0
+        self._last_offer = None
+        self._pending = None
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='snapshot-writer', daemon=True)
+        self._thread.start()
+
+    def due(self, generation):
+        if self.interval is not None:
+            return self._last_offer is None or time.perf_counter() - self._last_offer >= self.interval
+        return self.every is not None and generation % self.every == 0
+
+    def offer(self, generation, capture):
+        # capture() builds the state to render; it is only called when a snapshot is due
+        if not self.due(generation):
+            return False
+        self._put(generation, capture())
+        return True
+
+    def _put(self, generation, state):
+        self._last_offer = time.perf_counter()
+        with self._condition:
+            if self._pending is not None:
+                self.dropped += 1
+            self._pending = (generation, state)
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._pending is None and not self._closed:
+                    self._condition.wait()
+                if self._pending is None:
+                    return
+                generation, state = self._pending
+                self._pending = None
+            self.render(generation, state)
+            self.written += 1
+
+    def close(self, generation=None, state=None):
+        if state is not None:
+            self._put(generation, state)
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+
+    def report(self):
+        return "{} snapshots written, {} dropped".format(self.written, self.dropped)
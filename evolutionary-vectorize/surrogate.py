@@ -0,0 +1,62 @@
+import math
+import random
+
+import numpy
+
+SURROGATE_AUDIT_RATE = 0.05
+
+
+class SurrogateScreen:
+    # Keeps only the `keep` fraction of a batch of offspring that a cheap surrogate score ranks highest,
+    # so the rest never cost an exact evaluation. A random `audit_rate` of the batches is also kept
+    # aside and scored exactly in audit(), to measure how well the surrogate ranking matches the exact
+    # one: the share of the exact top `keep` the surrogate kept, and the share of pairs it orders alike.
+
+    def __init__(self, score, keep, audit_rate=SURROGATE_AUDIT_RATE):
+        self.score = score
+        self.keep = keep
+        self.audit_rate = audit_rate
+        # audits are drawn from their own stream so switching them on does not change the run
+        self.rng = random.Random()
+        self.pending = []
+        self.screened = 0
+        self.skipped = 0
+        self.audits = 0
+        self.top_agreement = 0.0
+        self.pair_agreement = 0.0
+
+    def screen(self, units):
+        if len(units) < 2:
+            return units
+        scores = self.score(units)
+        order = numpy.argsort(-scores, kind='stable')
+        count = max(1, int(math.ceil(self.keep * len(units))))
+        self.screened += len(units)
+        self.skipped += len(units) - count
+        if self.rng.random() < self.audit_rate:
+            self.pending.append((units, scores, count))
+        return [units[i] for i in order[:count]]
+
+    def audit(self, evaluate):
+        # scores the audited batches exactly with evaluate(units) and folds them into the agreement
+        if not self.pending:
+            return
+        evaluate([unit for units, _, _ in self.pending for unit in units])
+        for units, scores, count in self.pending:
+            exact = numpy.array([unit.fitness for unit in units])
+            surrogate_top = set(numpy.argsort(-scores, kind='stable')[:count].tolist())
+            exact_top = set(numpy.argsort(-exact, kind='stable')[:count].tolist())
+            self.top_agreement += len(surrogate_top & exact_top) / count
+            upper = numpy.triu_indices(len(units), 1)
+            same = numpy.sign(numpy.subtract.outer(scores, scores)) == numpy.sign(numpy.subtract.outer(exact, exact))
+            self.pair_agreement += numpy.mean(same[upper])
+            self.audits += 1
+        self.pending = []
+
+    def report(self):
+        report = "surrogate skipped {} of {} offspring ({:.0%})".format(
+            self.skipped, self.screened, self.skipped / self.screened if self.screened else 0.0)
+        if self.audits:
+            report += ", {} audits: {:.0%} of the exact top {:.0%} kept, {:.0%} of pairs ordered alike".format(
+                self.audits, self.top_agreement / self.audits, self.keep, self.pair_agreement / self.audits)
+        return report
@@ -0,0 +1,98 @@
+import hashlib
+import os
+
+import numpy
+
+from colorsci import srgb_to_lab
+
+CACHE_DIR = os.environ.get('TARGET_STORE_DIR', 'cache')
+
+
+def sources_key(paths, *extra):
+    # Cheap identity of the inputs: names, sizes and mtimes, so unchanged sources are never decoded again
+    digest = hashlib.sha1()
+    for path in paths:
+        stat = os.stat(path)
+        digest.update('{}:{}:{}\n'.format(path, stat.st_size, stat.st_mtime_ns).encode())
+    for value in extra:
+        digest.update('{}\n'.format(value).encode())
+    return digest.hexdigest()[:16]
+
+
+def _open_tmp(path, dtype, shape):
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    return tmp_path, numpy.lib.format.open_memmap(tmp_path, mode='w+', dtype=dtype, shape=shape)
+
+
+def _close_atomic(tmp_path, array, path):
+    array.flush()
+    del array
+    os.replace(tmp_path, path)
+
+
+class TargetStore:
+    # Stacked (chunks, rows, cols, 3) uint8 targets plus their Lab form, stored as .npy files and
+    # memory-mapped read-only, so every process shares the same pages instead of decoding its own copy.
+    # Tables derived from the targets, like the palette distances, are published and mapped alongside.
+
+    def __init__(self, base):
+        self.base = base
+        self.rgb = numpy.load(base + '-rgb.npy', mmap_mode='r')
+        self.lab = numpy.load(base + '-lab.npy', mmap_mode='r')
+        self._tables = {}
+
+    def __len__(self):
+        return len(self.rgb)
+
+    def __getitem__(self, chunk):
+        return self.rgb[chunk]
+
+    def table(self, name, build):
+        # (chunks, ...) float64 table stored next to the targets as `name`, built once with build(chunk)
+        # a chunk at a time by the first process to ask and then mapped read-only by every process
+        if name not in self._tables:
+            path = '{}-{}.npy'.format(self.base, name)
+            if not os.path.exists(path):
+                tmp_path = table = None
+                for chunk in range(len(self)):
+                    entry = build(chunk)
+                    if table is None:
+                        tmp_path, table = _open_tmp(path, numpy.float64, (len(self),) + entry.shape)
+                    table[chunk] = entry
+                _close_atomic(tmp_path, table, path)
+            self._tables[name] = numpy.load(path, mmap_mode='r')
+        return self._tables[name]
+
+    @staticmethod
+    def exists(base):
+        return os.path.exists(base + '-rgb.npy') and os.path.exists(base + '-lab.npy')
+
+    @staticmethod
+    def publish(base, blocks, count):
+        # `blocks` yields the count targets a few chunks at a time; each block is written straight into
+        # the mapped files, so the whole stack is never held in memory
+        os.makedirs(os.path.dirname(base) or '.', exist_ok=True)
+        rgb = lab = None
+        start = 0
+        for block in blocks:
+            block = numpy.asarray(block, dtype=numpy.uint8)
+            if rgb is None:
+                rgb_tmp, rgb = _open_tmp(base + '-rgb.npy', numpy.uint8, (count,) + block.shape[1:])
+                lab_tmp, lab = _open_tmp(base + '-lab.npy', numpy.float64, (count,) + block.shape[1:])
+            rgb[start:start + len(block)] = block
+            lab[start:start + len(block)] = srgb_to_lab(block)
+            start += len(block)
+        if start != count:
+            raise ValueError("expected {} targets, got {}".format(count, start))
+        _close_atomic(lab_tmp, lab, base + '-lab.npy')
+        # rgb goes last: its presence marks a complete store
+        _close_atomic(rgb_tmp, rgb, base + '-rgb.npy')
+        return TargetStore(base)
+
+
+def load_or_publish(key, build, count, cache_dir=CACHE_DIR):
+    # build() returns an iterable of target blocks, see TargetStore.publish
+    base = os.path.join(cache_dir, 'targets-' + key)
+    if TargetStore.exists(base):
+        return TargetStore(base)
+    return TargetStore.publish(base, build(), count)
@@ -1,6 +1,7 @@
 import math
 import random
 
+import numpy
 import svgwrite
 from svgwrite.extensions import Inkscape
 
@@ -9,6 +10,9 @@ MAX_SQUARE_SIZE = 50
 GRID_WIDTH = 870
 GRID_HEIGHT = 695
 
+# sizes a square is drawn from, inclusive
+SQUARE_SIZES = (50, 125)
+
 
 def distance_fst(pt1, pt2):
     return (pt1[0] - pt2[0]) ** 2 + (pt1[1] - pt2[1]) ** 2
@@ -44,36 +48,65 @@ def optimize_circles(circles: list):
     return sort_circles
 
 
+class FreeSquares:
+    # For every corner (x, y), the largest square that still fits there: inside the grid with a cell to
+    # spare, clear of every placed square and at most the largest size. A square of size s covers the
+    # (s - 1) x (s - 1) cells from its corner, so it is free exactly when fits[x, y] >= s, and placing
+    # one only lowers fits in the patch up and left of its far corner. weights counts the sizes each
+    # corner still takes, with per-row totals, so a placement is drawn in proportion to them: the same
+    # odds as random tries that are kept only when they land on free space.
+
+    def __init__(self, width, height, smallest, largest):
+        self.smallest = smallest
+        self.largest = largest
+        x = numpy.arange(width)[:, None]
+        y = numpy.arange(height)[None, :]
+        self.fits = numpy.minimum(numpy.minimum(width - 1 - x, height - 1 - y), largest)
+        self.weights = numpy.maximum(self.fits - smallest + 1, 0)
+        self.row_weights = self.weights.sum(axis=1)
+
+    def choose(self):
+        # (x, y, size) of a free square, or None once no square of any size fits
+        total = int(self.row_weights.sum())
+        if total == 0:
+            return None
+        pick = random.randrange(total)
+        rows = numpy.cumsum(self.row_weights)
+        x = int(numpy.searchsorted(rows, pick, side='right'))
+        pick -= int(rows[x] - self.row_weights[x])
+        columns = numpy.cumsum(self.weights[x])
+        y = int(numpy.searchsorted(columns, pick, side='right'))
+        pick -= int(columns[y] - self.weights[x, y])
+        return x, y, self.smallest + pick
+
+    def place(self, x1, y1, size):
+        # a corner before the square's far corner keeps only the squares that end before it starts
+        x0, y0 = max(0, x1 - self.largest), max(0, y1 - self.largest)
+        x2, y2 = x1 + size - 1, y1 + size - 1
+        x = numpy.arange(x0, x2)[:, None]
+        y = numpy.arange(y0, y2)[None, :]
+        fits = self.fits[x0:x2, y0:y2]
+        numpy.minimum(fits, numpy.maximum(x1 - x, y1 - y) + 1, out=fits)
+        self.weights[x0:x2, y0:y2] = numpy.maximum(fits - self.smallest + 1, 0)
+        self.row_weights[x0:x2] = self.weights[x0:x2].sum(axis=1)
+
+
 def main():
-    grid = {(x, y): None for x in range(GRID_WIDTH) for y in range(GRID_HEIGHT)}
+    free = FreeSquares(GRID_WIDTH, GRID_HEIGHT, *SQUARE_SIZES)
 
     squares_filled = 0
     sq_counter = 0
-    iters = 0
 
     lines = []
     circles = []
 
     while squares_filled < GRID_WIDTH * GRID_HEIGHT:
-        iters += 1
-
-        if iters == 1000000:
+        square = free.choose()
+        if square is None:
             break
-
-        print("iter {} filled {} / {} squares  {}".format(iters, squares_filled, GRID_HEIGHT * GRID_WIDTH, sq_counter))
-
-        size = random.randint(50, 125)
-        x1 = random.randint(0, GRID_WIDTH - 1)
-        y1 = random.randint(0, GRID_HEIGHT - 1)
-        if x1 + size >= GRID_WIDTH or y1 + size >= GRID_HEIGHT:
-            continue
-        all_free = all(grid[(x1 + x, y1 + y)] is None for x in range(size - 1) for y in range(size - 1))
-        if not all_free:
-            continue
+        x1, y1, size = square
         squares_filled += size * size
-        for x in range(size - 1):
-            for y in range(size - 1):
-                grid[(x1 + x, y1 + y)] = sq_counter
+        free.place(x1, y1, size)
         sq_counter += 1
         # if x1 == 0:
         #    lines.append(((x1, y1), (x1 + size, y1)))
@@ -83,6 +116,8 @@ def main():
         lines.append(((x1 + size, y1), (x1 + size, y1 + size)))
         circles.append((x1 + size / 2, y1 + size / 2, size / 2))
 
+    print("filled {} / {} squares  {}".format(squares_filled, GRID_HEIGHT * GRID_WIDTH, sq_counter))
+
     drawing = svgwrite.Drawing(size=(1056, 816), filename='grid.svg')
     inkscape = Inkscape(drawing)
     layer = inkscape.layer("0 squares")
@@ -0,0 +1,93 @@
+import argparse
+import json
+import os
+import time
+
+import numpy
+
+import vec
+from stopwatch import Stopwatch
+
+# IMAGE_EXTENSIONS, find_sources and output_name are kept identical in the evvec and vec batch scripts
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tif', '.tiff')
+
+
+def find_sources(paths):
+    # images named directly, every image in a named directory, and the paths listed in a manifest
+    # (any other file: one path per line, relative to the manifest, # starts a comment)
+    sources = []
+    for path in paths:
+        if os.path.isdir(path):
+            sources.extend(sorted(os.path.join(path, name) for name in os.listdir(path)
+                                  if name.lower().endswith(IMAGE_EXTENSIONS)))
+        elif path.lower().endswith(IMAGE_EXTENSIONS):
+            sources.append(path)
+        else:
+            with open(path) as f:
+                for line in f:
+                    line = line.split('#', 1)[0].strip()
+                    if line:
+                        sources.append(os.path.join(os.path.dirname(path), line))
+    return sources
+
+
+def output_name(source):
+    return os.path.splitext(os.path.basename(source))[0] + '.svg'
+
+
+def vectorize_image(source, output, coverage, seed):
+    # runs in a worker; the palette table stays mapped in the worker between images
+    start = time.perf_counter()
+    alleles = vec.vectorize(source, output, coverage, seed)
+    return alleles, time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Vectorize many images on one worker pool")
+    parser.add_argument('targets', nargs='+', help="images, directories of images or manifest files")
+    parser.add_argument('--out', default='batch', help="directory for the drawings and summary.json")
+    parser.add_argument('--coverage', type=float, default=vec.COVERAGE_GOAL,
+                        help="share of the paper to cover")
+    parser.add_argument('--seed', type=int, default=None,
+                        help="seed for reproducible drawings; each image gets its own seed derived from it")
+    args = parser.parse_args(argv)
+    if not 0 < args.coverage <= 1:
+        parser.error("--coverage must be in (0, 1]")
+    sources = find_sources(args.targets)
+    if not sources:
+        parser.error("no images found in {}".format(' '.join(args.targets)))
+    outputs = [os.path.join(args.out, output_name(source)) for source in sources]
+    if len(set(outputs)) != len(outputs):
+        parser.error("images with the same name would overwrite each other's drawing")
+
+    os.makedirs(args.out, exist_ok=True)
+    # one seed per image, so an image's drawing does not depend on which worker draws it or when
+    seeds = numpy.random.SeedSequence(args.seed).spawn(len(sources))
+    # build the table once here rather than racing to build it in every worker
+    vec.palette_lut()
+    sw = Stopwatch()
+    sw.start()
+    try:
+        futures = [vec.THREAD_POOL.submit(vectorize_image, source, output, args.coverage, seed)
+                   for source, output, seed in zip(sources, outputs, seeds)]
+        images = []
+        for source, output, future in zip(sources, outputs, futures):
+            alleles, seconds = future.result()
+            images.append({'source': source, 'output': output, 'alleles': alleles, 'seconds': seconds})
+    finally:
+        vec.THREAD_POOL.shutdown()
+    total = sw.duration()
+
+    busy = sum(image['seconds'] for image in images)
+    summary = {'coverage': args.coverage, 'seed': args.seed, 'images': images, 'total_seconds': total,
+               'seconds_per_image': total / len(images), 'worker_seconds': busy}
+    with open(os.path.join(args.out, 'summary.json'), 'w') as f:
+        json.dump(summary, f, indent=2)
+    for image in images:
+        print("{source}: {alleles} alleles in {seconds:.2f}s -> {output}".format(**image))
+    print("{} images in {:.2f}s ({:.2f}s per image, {:.2f}s of worker time)".format(len(images), total,
+                                                                                  total / len(images), busy))
+
+
+if __name__ == "__main__":
+    main()
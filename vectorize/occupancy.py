@@ -0,0 +1,74 @@
+import numpy
+
+
+class Occupancy:
+    # Which cells of a (width, height) canvas are covered by strokes, with an index of the free cells so
+    # new strokes can start on free space instead of being drawn blind and rejected. Cells are flat
+    # x * height + y indices. `covered` starts the canvas with cells already taken. A `region` mask limits
+    # both the cells the index hands out and the ones `count` counts; strokes may still cover cells
+    # outside it. Covered cells leave the index lazily: it is rebuilt once most of a draw lands on them.
+
+    def __init__(self, width, height, covered=None, region=None):
+        self.width = width
+        self.height = height
+        # a copy, so the flat view below always shares its memory
+        self.covered = numpy.zeros((width, height), dtype=bool) if covered is None else numpy.array(covered, dtype=bool)
+        self._cells = self.covered.reshape(-1)
+        self._region = None if region is None else region.reshape(-1)
+        self.size = self._cells.size if region is None else int(numpy.count_nonzero(region))
+        self.count = int(numpy.count_nonzero(self._cells if region is None else self._cells & self._region))
+        self._free = self._free_cells()
+
+    @property
+    def fraction(self):
+        return self.count / self.size
+
+    def flat(self, pts):
+        return pts[:, 0] * self.height + pts[:, 1]
+
+    def _free_cells(self):
+        if self._region is None:
+            return numpy.flatnonzero(~self._cells)
+        return numpy.flatnonzero(self._region & ~self._cells)
+
+    def sample_free(self, count, rng):
+        # up to `count` free cells drawn uniformly with replacement; empty only once no cell is free
+        fresh = self._free[:0]
+        if len(self._free):
+            cells = self._free[rng.integers(0, len(self._free), count)]
+            fresh = cells[~self._cells[cells]]
+            if 2 * len(fresh) >= len(cells):
+                return fresh
+        self._free = self._free_cells()
+        if not len(fresh) and len(self._free):
+            return self.sample_free(count, rng)
+        return fresh
+
+    def place(self, pts, lengths, limit=None):
+        # Marks every segment, in order, that overlaps neither a covered cell nor an earlier free segment of
+        # the batch, stopping once `count` reaches `limit`. pts holds each segment's unique pixels,
+        # grouped by segment. Returns the mask of placed segments.
+        count = len(lengths)
+        owner = numpy.repeat(numpy.arange(count), lengths)
+        cells = self.flat(pts)
+        free = numpy.ones(count, dtype=bool)
+        free[owner[self._cells[cells]]] = False
+
+        # a cell wanted by several free segments goes to the first; the others lose it. Assigning in
+        # reverse leaves the first owner of every repeated index in place.
+        candidate = free[owner]
+        claimed = numpy.full(self._cells.size, count)
+        claimed[cells[candidate][::-1]] = owner[candidate][::-1]
+        placed = free.copy()
+        placed[owner[candidate & (claimed[cells] != owner)]] = False
+
+        counted = lengths
+        if self._region is not None:
+            counted = numpy.bincount(owner, weights=self._region[cells], minlength=count).astype(numpy.intp)
+        if limit is not None:
+            index = numpy.flatnonzero(placed)
+            before = self.count + numpy.cumsum(counted[index]) - counted[index]
+            placed[index[before >= limit]] = False
+        self._cells[cells[placed[owner]]] = True
+        self.count += int(counted[placed].sum())
+        return placed
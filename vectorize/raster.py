@@ -0,0 +1,100 @@
+from functools import lru_cache
+
+import numpy
+
+SEGMENT_CACHE_SIZE = 1 << 16
+
+
+def rasterize_segments(starts, ends):
+    # Pixels of a batch of segments as produced by the old recursive midpoint split, computed one
+    # recursion level at a time for the whole batch. numpy.round rounds half to even like round(), so
+    # the pixel sets are identical. Returns (pts, lengths): the unique (x, y) pixels of every segment,
+    # grouped by segment in input order, and the pixel count of each segment.
+    starts = numpy.asarray(starts).reshape(-1, 2)
+    ends = numpy.asarray(ends).reshape(-1, 2)
+    count = len(starts)
+    if count == 0:
+        return numpy.empty((0, 2), dtype=numpy.int64), numpy.zeros(0, dtype=numpy.intp)
+
+    owner = numpy.arange(count)
+    p1, p2 = starts, ends
+    emitted_pts = []
+    emitted_owner = []
+    while len(owner):
+        mp = numpy.round((p1 + p2) / 2)
+        is_p1 = numpy.all(mp == p1, axis=1)
+        is_p2 = numpy.all(mp == p2, axis=1) & ~is_p1
+        split = ~(is_p1 | is_p2)
+
+        emitted_pts.extend((p1[is_p1], p2[is_p2], mp[split]))
+        emitted_owner.extend((owner[is_p1], owner[is_p2], owner[split]))
+
+        owner = numpy.concatenate((owner[split], owner[split]))
+        p1, p2 = numpy.concatenate((p1[split], mp[split])), numpy.concatenate((mp[split], p2[split]))
+
+    pts = numpy.concatenate(emitted_pts).astype(numpy.int64)
+    owner = numpy.concatenate(emitted_owner)
+
+    order = numpy.lexsort((pts[:, 1], pts[:, 0], owner))
+    pts, owner = pts[order], owner[order]
+    keep = numpy.ones(len(pts), dtype=bool)
+    keep[1:] = (owner[1:] != owner[:-1]) | numpy.any(pts[1:] != pts[:-1], axis=1)
+    return pts[keep], numpy.bincount(owner[keep], minlength=count)
+
+
+@lru_cache(maxsize=SEGMENT_CACHE_SIZE)
+def _segment_pts(start, end):
+    # one segment is cheaper to split with plain tuples than through the batched array path
+    found = set()
+    stack = [(start, end)]
+    while stack:
+        pt1, pt2 = stack.pop()
+        mp = (round((pt1[0] + pt2[0]) / 2), round((pt1[1] + pt2[1]) / 2))
+        if mp == pt1:
+            found.add(pt1)
+        elif mp == pt2:
+            found.add(pt2)
+        else:
+            found.add(mp)
+            stack.append((pt1, mp))
+            stack.append((mp, pt2))
+    pts = numpy.array(sorted(found), dtype=numpy.int64)
+    pts.setflags(write=False)
+    return pts
+
+
+def segment_pts(start, end):
+    # Cached pixels of one segment as a read-only (n, 2) array
+    return _segment_pts(tuple(start), tuple(end))
+
+
+class SegmentStencils:
+    # Pixels of every segment reaching at most `reach` along each axis, as offsets from its start. The
+    # midpoint split rounds half to even, so a segment's pixels only move along with it when it moves by
+    # an even amount: there is one stencil per start parity and offset. pixels() is then a gather and
+    # gives exactly what rasterize_segments does.
+
+    def __init__(self, reach):
+        self.reach = reach
+        self.side = 2 * reach + 1
+        stencils = []
+        for px in range(2):
+            for py in range(2):
+                for dx in range(-reach, reach + 1):
+                    for dy in range(-reach, reach + 1):
+                        stencils.append(segment_pts((px, py), (px + dx, py + dy)) - (px, py))
+        self.lengths = numpy.array([len(stencil) for stencil in stencils], dtype=numpy.intp)
+        self.first = numpy.cumsum(self.lengths) - self.lengths
+        self.offsets = numpy.concatenate(stencils)
+
+    def pixels(self, starts, ends):
+        # (pts, lengths) of a batch of segments, like rasterize_segments
+        starts = numpy.asarray(starts, dtype=numpy.int64)
+        delta = numpy.asarray(ends, dtype=numpy.int64) - starts + self.reach
+        parity = starts & 1
+        stencil = ((parity[:, 0] * 2 + parity[:, 1]) * self.side + delta[:, 0]) * self.side + delta[:, 1]
+        lengths = self.lengths[stencil]
+        owner = numpy.repeat(numpy.arange(len(starts)), lengths)
+        index = numpy.arange(lengths.sum()) - numpy.repeat(numpy.cumsum(lengths) - lengths - self.first[stencil],
+                                                           lengths)
+        return self.offsets[index] + starts[owner], lengths
@@ -1,7 +1,10 @@
+import argparse
 import datetime
 import heapq
+import math
 import random
 import os
+import tempfile
 import uuid
 from concurrent.futures.process import ProcessPoolExecutor
 from concurrent.futures.thread import ThreadPoolExecutor
@@ -11,9 +14,10 @@ import cairosvg
 import numpy
 import svgwrite
 from PIL import Image
-from colormath.color_conversions import convert_color
-from colormath.color_diff import delta_e_cie2000
-from colormath.color_objects import sRGBColor, LabColor
+from image_cache import cached_image
+from occupancy import Occupancy
+from palette_lut import PaletteLUT
+from raster import SegmentStencils, segment_pts
 from svgwrite.extensions import Inkscape
 
 THREAD_POOL = ProcessPoolExecutor(max_workers=4)
@@ -21,6 +25,20 @@ THREAD_POOL = ProcessPoolExecutor(max_workers=4)
 PAPER_WIDTH = 425
 PAPER_HEIGHT = 550
 VECTOR_MANHATTAN_MAX = 10
+# share of the paper covered by strokes
+COVERAGE_GOAL = 0.25
+# candidate strokes rasterized and checked against the occupancy at a time; batches grow as free space
+# fragments and fewer candidates fit, to place about PLACEMENT_BATCH strokes each
+PLACEMENT_BATCH = 1024
+MAX_PLACEMENT_BATCH = 1 << 16
+# tiled mode: side of the square tiles placed and colored by one worker task
+TILE_SIZE = 256
+# stroke colors are jittered anyway, so a quantized table is plenty
+PALETTE_LUT_BITS = 6
+# source rows resized at a time when a target is scaled to the paper
+RESIZE_SOURCE_ROWS = 1024
+# relative standard deviation of the random weight on each stroke's cost for each color
+COLOR_JITTER = 0.1
 
 COLORS = [
     (23, 20, 15),
@@ -47,53 +65,71 @@ COLORS = [
 ]
 
 
-def open_as_array(fname):
-    i = Image.open(fname).convert('RGB')
-    return numpy.asarray(i)
-
-
-TARGET_ARRAY = open_as_array('bobross.png')
+SOURCE_IMAGE = 'bobross.png'
 
 
-def pts_recursive(pt1, pt2):
-    mx = round((pt1[0] + pt2[0]) / 2)
-    my = round((pt1[1] + pt2[1]) / 2)
-    mp = (mx, my)
-
-    if mp == pt1:
-        return [pt1]
-    if mp == pt2:
-        return [pt2]
-
-    return pts_recursive(pt1, mp) + [mp] + pts_recursive(mp, pt2)
+def open_as_array(fname):
+    # allele x indexes rows and y columns, so a target must be PAPER_WIDTH rows by PAPER_HEIGHT columns
+    source = cached_image(fname)
+    if source.shape[:2] == (PAPER_WIDTH, PAPER_HEIGHT):
+        return numpy.array(source)
+    return resize_rows(source, PAPER_WIDTH, PAPER_HEIGHT)
+
+
+def resize_rows(source, rows, columns):
+    # Bilinear resize of a (rows, columns, 3) array to the given size, like Image.resize, a band of
+    # output rows at a time. Each band resizes its own box of source rows plus a margin wider than the
+    # filter, so only about RESIZE_SOURCE_ROWS source rows are ever decoded into an image at once.
+    scale = source.shape[0] / rows
+    band = max(1, int(RESIZE_SOURCE_ROWS / scale))
+    margin = int(math.ceil(scale)) + 2
+    out = numpy.empty((rows, columns, 3), dtype=numpy.uint8)
+    for top in range(0, rows, band):
+        bottom = min(top + band, rows)
+        first = max(0, int(top * scale) - margin)
+        last = min(source.shape[0], int(math.ceil(bottom * scale)) + margin)
+        image = Image.fromarray(numpy.ascontiguousarray(source[first:last]))
+        out[top:bottom] = numpy.asarray(image.resize((columns, bottom - top), Image.BILINEAR,
+                                                     box=(0, top * scale - first, source.shape[1],
+                                                          bottom * scale - first)))
+    return out
+
+
+_PALETTE_LUT = None
+
+
+def palette_lut():
+    # one table per process, kept across the images of a batch
+    global _PALETTE_LUT
+    if _PALETTE_LUT is None:
+        _PALETTE_LUT = PaletteLUT(COLORS, bits=PALETTE_LUT_BITS)
+    return _PALETTE_LUT
 
 
 class Allele:
     start = None
     end = None
-    _pts = []
-
-    def __init__(self):
-        self.start = (random.randint(0, PAPER_WIDTH - 1), random.randint(0, PAPER_HEIGHT - 1))
-        ex = max(min(PAPER_WIDTH - 1, self.start[0] + random.randint(-VECTOR_MANHATTAN_MAX, VECTOR_MANHATTAN_MAX)), 0)
-        ey = max(min(PAPER_HEIGHT - 1, self.start[1] + random.randint(-VECTOR_MANHATTAN_MAX, VECTOR_MANHATTAN_MAX)), 0)
-        self.end = (ex, ey)
-        self._pts = set(pts_recursive(self.start, self.end))
+    _pixels = None
+
+    def __init__(self, start=None, end=None, pixels=None):
+        if start is None:
+            start = (random.randint(0, PAPER_WIDTH - 1), random.randint(0, PAPER_HEIGHT - 1))
+            ex = max(min(PAPER_WIDTH - 1, start[0] + random.randint(-VECTOR_MANHATTAN_MAX, VECTOR_MANHATTAN_MAX)), 0)
+            ey = max(min(PAPER_HEIGHT - 1, start[1] + random.randint(-VECTOR_MANHATTAN_MAX, VECTOR_MANHATTAN_MAX)), 0)
+            end = (ex, ey)
+        self.start = start
+        self.end = end
+        self._pixels = pixels
 
+    @property
+    def pixels(self):
+        if self._pixels is None:
+            self._pixels = segment_pts(self.start, self.end)
+        return self._pixels
 
     @property
     def allele_pts(self):
-        return self._pts
-
-
-def to_lab_color(c1):
-    color1_rgb = sRGBColor(c1[0], c1[1], c1[2], True)
-    return convert_color(color1_rgb, LabColor)
-
-
-def color_distance(c1, c2):
-    # Find the color difference
-    return delta_e_cie2000(c1, c2)
+        return set(map(tuple, self.pixels.tolist()))
 
 
 def unit_to_svg(representation):
@@ -120,44 +156,73 @@ def add_to_drawing(drawing, inkscape, layers, representation, offset=(0, 0)):
     return drawing
 
 
-def main():
-    miss_cnt = 0
-    covered_pts = set([])
-    alleles = []
-    goal_coverage = PAPER_HEIGHT * PAPER_WIDTH * 0.25
-    while len(covered_pts) < goal_coverage:
-        if len(alleles) % 100 == 0:
-            print("Generated {} alleles ({} misses, {}/{} covered)...".format(len(alleles), miss_cnt, len(covered_pts), goal_coverage))
-
-        gen = Allele()
-        if any([pt in covered_pts for pt in gen.allele_pts]):
-            miss_cnt += 1
-            continue
-        covered_pts |= set(gen.allele_pts)
-        alleles.append(gen)
-
-    print("Generated {} alleles".format(len(alleles)))
-
+def place_strokes(occupancy, goal, rng):
+    # Non-overlapping random strokes until occupancy.count reaches `goal`, or no free cell is left to start one.
+    # Like Allele() a stroke reaches up to VECTOR_MANHATTAN_MAX from its start, but the start is drawn
+    # from the free cells, since a stroke starting on a covered one could never be placed. Returns the
+    # (strokes, 2) starts and ends, and the pixels and pixel count of every stroke.
+    placed_strokes = []
+    batch = PLACEMENT_BATCH
+    stencils = SegmentStencils(VECTOR_MANHATTAN_MAX)
+    limits = [occupancy.width - 1, occupancy.height - 1]
+    while occupancy.count < goal:
+        cells = occupancy.sample_free(batch, rng)
+        if not len(cells):
+            break
+        starts = numpy.stack(numpy.divmod(cells, occupancy.height), axis=1)
+        ends = numpy.clip(starts + rng.integers(-VECTOR_MANHATTAN_MAX, VECTOR_MANHATTAN_MAX + 1, starts.shape), 0,
+                          limits)
+        # a covered end rules a candidate out before it is rasterized
+        open_end = ~occupancy.covered[ends[:, 0], ends[:, 1]]
+        starts, ends = starts[open_end], ends[open_end]
+        pts, lengths = stencils.pixels(starts, ends)
+        placed = occupancy.place(pts, lengths, limit=goal)
+        count = numpy.count_nonzero(placed)
+        batch = int(min(max(PLACEMENT_BATCH * len(cells) / max(count, 1), PLACEMENT_BATCH), MAX_PLACEMENT_BATCH))
+        placed_strokes.append((starts[placed], ends[placed], pts[numpy.repeat(placed, lengths)], lengths[placed]))
+    if not placed_strokes:
+        empty = numpy.zeros((0, 2), dtype=numpy.int64)
+        return empty, empty, empty, numpy.zeros(0, dtype=numpy.intp)
+    return tuple(numpy.concatenate(parts) for parts in zip(*placed_strokes))
+
+
+def color_costs(pts, lengths, target, lut):
+    # (strokes, palette) matrix of the summed distance from each palette color to each stroke's pixels
+    distances = lut.distances(target[pts[:, 0], pts[:, 1]])
+    return numpy.add.reduceat(distances, numpy.cumsum(lengths) - lengths, axis=0, dtype=numpy.float64)
+
+
+def assign_colors(pts, lengths, target, lut, rng):
+    # index into COLORS of the cheapest color for every stroke, each cost weighted by a random jitter
+    if not len(lengths):
+        return numpy.zeros(0, dtype=numpy.intp)
+    costs = color_costs(pts, lengths, target, lut)
+    return numpy.argmin(costs * rng.normal(1.0, COLOR_JITTER, costs.shape), axis=1)
+
+
+def stroke_alleles(starts, ends, colors):
+    # representation of colored strokes, COLORS -> Alleles
     rep = {}
     for color in COLORS:
         rep[color] = []
+    for start, end, color in zip(starts.tolist(), ends.tolist(), colors.tolist()):
+        rep[COLORS[color]].append(Allele(tuple(start), tuple(end)))
+    return rep
+
+
+def vectorize(source, filename, coverage=COVERAGE_GOAL, seed=None):
+    target = open_as_array(source)
+    rng = numpy.random.default_rng(seed)
+    occupancy = Occupancy(PAPER_WIDTH, PAPER_HEIGHT)
+    starts, ends, pts, lengths = place_strokes(occupancy, PAPER_HEIGHT * PAPER_WIDTH * coverage, rng)
+
+    print("Generated {} alleles, {:.1%} covered".format(len(starts), occupancy.fraction))
+    allele_count = len(starts)
 
-    processed = 0
-    for allele in alleles:
-        if processed % 100 == 0:
-            print("Colored {} alleles...".format(processed))
-        pts = allele.allele_pts
-        colors = [to_lab_color(TARGET_ARRAY[pt]) for pt in pts]
-        color_dists = {}
-        for color in COLORS:
-            lab_color = to_lab_color(color)
-            distance = sum([color_distance(lab_color, pt_color) for pt_color in colors]) * random.gauss(1.0, 0.1)
-            color_dists[color] = distance
-        best_color = min(COLORS, key=lambda x: color_dists[x])
-        rep[best_color].append(allele)
-        processed += 1
-
-    drawing = svgwrite.Drawing(size=(870, 695), filename='generated.svg')
+    rep = stroke_alleles(starts, ends, assign_colors(pts, lengths, target, palette_lut(), rng))
+    print("Colored {} alleles".format(allele_count))
+
+    drawing = svgwrite.Drawing(size=(870, 695), filename=filename, debug=False)
     inkscape = Inkscape(drawing)
     layers = {}
     scale = 1.58096
@@ -170,6 +235,99 @@ def main():
 
     add_to_drawing(drawing, inkscape, layers, rep, offset=(93, 61))
     drawing.save()
+    return allele_count
+
+
+def tile_cores(width, height, size):
+    # (x0, y0, x1, y1) of every size x size tile, the last row and column cut at the edge
+    return [(x, y, min(x + size, width), min(y + size, height))
+            for x in range(0, width, size) for y in range(0, height, size)]
+
+
+def tile_window(core, width, height):
+    # the cells strokes starting in `core` can reach
+    x0, y0, x1, y1 = core
+    return (max(x0 - VECTOR_MANHATTAN_MAX, 0), max(y0 - VECTOR_MANHATTAN_MAX, 0),
+            min(x1 + VECTOR_MANHATTAN_MAX, width), min(y1 + VECTOR_MANHATTAN_MAX, height))
+
+
+def vectorize_tile(target, covered, core, coverage, seed):
+    # Runs in a worker: places and colors the strokes of one tile. target and covered are the tile's
+    # window and core the tile within it. Strokes start in the core until it is `coverage` covered and
+    # may spill into the rest of the window. Returns window-local starts and ends, color indices and the
+    # window's updated coverage.
+    x0, y0, x1, y1 = core
+    region = numpy.zeros(covered.shape, dtype=bool)
+    region[x0:x1, y0:y1] = True
+    occupancy = Occupancy(covered.shape[0], covered.shape[1], covered=covered, region=region)
+    rng = numpy.random.default_rng(seed)
+    starts, ends, pts, lengths = place_strokes(occupancy, coverage * occupancy.size, rng)
+    return starts, ends, assign_colors(pts, lengths, target, palette_lut(), rng), occupancy.covered
+
+
+def vectorize_tiled(source, filename, coverage=COVERAGE_GOAL, seed=None, tile_size=TILE_SIZE):
+    # Covers the whole image at its own size, one tile per worker task. Tiles go in four phases by the
+    # parity of their row and column, so the tiles of a phase are a tile apart and their windows never
+    # meet. Each phase starts from the coverage left by the ones before, and every tile has its own
+    # seed, so a seeded drawing comes out the same however the tasks are scheduled. The target is mapped
+    # from the image cache and the coverage lives in a temporary file, so only the tiles in flight are
+    # ever in memory. Tiles work in (row, column) cells like the target; the drawing is in the image's
+    # own orientation, x along the columns.
+    target = cached_image(source)
+    rows, columns = target.shape[:2]
+    covered = numpy.memmap(tempfile.TemporaryFile(), dtype=bool, mode='w+', shape=(rows, columns))
+    covered_count = 0
+    cores = tile_cores(rows, columns, tile_size)
+    seeds = numpy.random.SeedSequence(seed).spawn(len(cores))
+    palette_lut()
+    strokes = []
+    for phase in range(4):
+        tasks = []
+        for core, tile_seed in zip(cores, seeds):
+            if (core[0] // tile_size % 2) * 2 + core[1] // tile_size % 2 != phase:
+                continue
+            wx0, wy0, wx1, wy1 = window = tile_window(core, rows, columns)
+            local = (core[0] - wx0, core[1] - wy0, core[2] - wx0, core[3] - wy0)
+            tasks.append((window, THREAD_POOL.submit(vectorize_tile, target[wx0:wx1, wy0:wy1],
+                                                     covered[wx0:wx1, wy0:wy1], local, coverage, tile_seed)))
+        for (wx0, wy0, wx1, wy1), future in tasks:
+            starts, ends, colors, window_covered = future.result()
+            covered_count += numpy.count_nonzero(window_covered) - numpy.count_nonzero(covered[wx0:wx1, wy0:wy1])
+            covered[wx0:wx1, wy0:wy1] = window_covered
+            strokes.append((starts + (wx0, wy0), ends + (wx0, wy0), colors))
+        print("Tiled phase {} done, {:.1%} covered".format(phase + 1, covered_count / covered.size))
+
+    starts, ends, colors = (numpy.concatenate(parts) for parts in zip(*strokes))
+    print("Generated and colored {} alleles".format(len(starts)))
+    drawing = svgwrite.Drawing(size=(columns, rows), filename=filename, debug=False)
+    add_to_drawing(drawing, Inkscape(drawing), {}, stroke_alleles(starts[:, ::-1], ends[:, ::-1], colors))
+    drawing.save()
+    return len(starts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cover {} with short colored strokes".format(SOURCE_IMAGE))
+    parser.add_argument('--coverage', type=float, default=COVERAGE_GOAL, help="share of the paper to cover")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--source', default=SOURCE_IMAGE)
+    parser.add_argument('--out', default='generated.svg')
+    parser.add_argument('--tiled', action='store_true',
+                        help="cover the image at its own size instead of the paper, in tiles spread over the "
+                             "worker pool")
+    parser.add_argument('--tile-size', type=int, default=TILE_SIZE)
+    args = parser.parse_args()
+    if not 0 < args.coverage <= 1:
+        parser.error("--coverage must be in (0, 1]")
+    if args.tile_size <= 2 * VECTOR_MANHATTAN_MAX:
+        parser.error("--tile-size must be over {} so tiles of a phase never share cells".format(
+            2 * VECTOR_MANHATTAN_MAX))
+    try:
+        if args.tiled:
+            vectorize_tiled(args.source, args.out, coverage=args.coverage, seed=args.seed, tile_size=args.tile_size)
+        else:
+            vectorize(args.source, args.out, coverage=args.coverage, seed=args.seed)
+    finally:
+        THREAD_POOL.shutdown()
 
 
 if __name__ == "__main__":